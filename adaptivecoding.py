@@ -0,0 +1,120 @@
+'''This module implements a one-pass adaptive Huffman codec for bytes that needs no trained model.
+
+Encoder and decoder both start from uniform counts over the 256 byte values. Data is coded in
+blocks, and after each block both sides add its byte counts and rebuild the same canonical
+code, so they stay in sync without any side file. Blocks start small and double up to the
+configured size so the code adapts quickly at the start of the stream. Counts are halved once
+they pass a limit so the code keeps following data whose distribution drifts.'''
+import io
+import struct
+from collections import Counter
+from huffmancoding import canonicalHuffmanCodingFromFrequency, encode, packBits, buildByteDecodeTable, decodePackedSymbols, writeVarint
+
+# Adaptive stream: magic, format version, largest block size and count limit.
+ADAPTIVE_MAGIC = b'HUFA'
+ADAPTIVE_VERSION = 1
+ADAPTIVE_HEADER = struct.Struct('>4sBII')
+
+DEFAULT_BLOCK_SIZE = 1 << 14
+INITIAL_BLOCK_SIZE = 256
+DEFAULT_COUNT_LIMIT = 1 << 20
+
+
+def buildAdaptiveCode(counts):
+    '''Build the 256-entry byte code table for the current counts.'''
+    huffman_code = canonicalHuffmanCodingFromFrequency(dict(enumerate(counts)))
+    return [huffman_code[byte] for byte in range(256)]
+
+def updateAdaptiveCounts(counts, block, count_limit=DEFAULT_COUNT_LIMIT):
+    '''Add the byte counts of a block, halving all counts (keeping them at least 1) past the limit.'''
+    for byte, count in Counter(block).items():
+        counts[byte] += count
+    if sum(counts) > count_limit:
+        for byte in range(256):
+            counts[byte] = (counts[byte] + 1) // 2
+
+def getBlockSizes(block_size):
+    '''Yield the size of each successive block: doubling from INITIAL_BLOCK_SIZE up to block_size.'''
+    size = min(INITIAL_BLOCK_SIZE, block_size)
+    while True:
+        yield size
+        size = min(size * 2, block_size)
+
+def encodeAdaptiveStream(reader, writer, block_size=DEFAULT_BLOCK_SIZE, count_limit=DEFAULT_COUNT_LIMIT):
+    '''Adaptively encode bytes from a binary reader to a binary writer. Return the number of bytes written.
+
+    Each block is written as its byte count, its bit length and its packed bits. A zero byte
+    count ends the stream.'''
+    written = writer.write(ADAPTIVE_HEADER.pack(ADAPTIVE_MAGIC, ADAPTIVE_VERSION, block_size, count_limit))
+    counts = [1] * 256
+    byte_code = buildAdaptiveCode(counts)
+    for size in getBlockSizes(block_size):
+        block = reader.read(size)
+        if not block:
+            break
+        encoded_block = encode(block, byte_code)
+        frame = bytearray()
+        writeVarint(frame, len(block))
+        writeVarint(frame, len(encoded_block))
+        frame += packBits(encoded_block)
+        written += writer.write(frame)
+        updateAdaptiveCounts(counts, block, count_limit)
+        byte_code = buildAdaptiveCode(counts)
+    written += writer.write(b'\x00')
+    return written
+
+def readStreamVarint(reader):
+    '''Read a varint from a binary reader.'''
+    value = 0
+    shift = 0
+    while True:
+        byte = reader.read(1)
+        if not byte:
+            raise ValueError("Truncated adaptive stream")
+        value |= (byte[0] & 0x7F) << shift
+        if byte[0] < 0x80:
+            return value
+        shift += 7
+
+def decodeAdaptiveStream(reader, writer):
+    '''Decode an adaptive stream from a binary reader to a binary writer. Return the number of bytes written.'''
+    header = reader.read(ADAPTIVE_HEADER.size)
+    if len(header) < ADAPTIVE_HEADER.size:
+        raise ValueError("Adaptive stream is too short")
+    magic, version, block_size, count_limit = ADAPTIVE_HEADER.unpack(header)
+    if magic != ADAPTIVE_MAGIC:
+        raise ValueError("Not an adaptive stream")
+    if version != ADAPTIVE_VERSION:
+        raise ValueError(f"Unsupported adaptive stream version {version}")
+
+    counts = [1] * 256
+    byte_code = buildAdaptiveCode(counts)
+    written = 0
+    for size in getBlockSizes(block_size):
+        symbol_count = readStreamVarint(reader)
+        if symbol_count == 0:
+            return written
+        if symbol_count > size:
+            raise ValueError("Corrupt adaptive stream")
+        bit_length = readStreamVarint(reader)
+        packed = reader.read((bit_length + 7) // 8)
+        if len(packed) * 8 < bit_length:
+            raise ValueError("Truncated adaptive stream")
+        block = bytes(decodePackedSymbols(packed, bit_length, buildByteDecodeTable(byte_code)))
+        if len(block) != symbol_count:
+            raise ValueError("Corrupt adaptive stream")
+        written += writer.write(block)
+        updateAdaptiveCounts(counts, block, count_limit)
+        byte_code = buildAdaptiveCode(counts)
+
+def encodeAdaptive(data, block_size=DEFAULT_BLOCK_SIZE, count_limit=DEFAULT_COUNT_LIMIT):
+    '''Adaptively encode bytes in memory.'''
+    writer = io.BytesIO()
+    encodeAdaptiveStream(io.BytesIO(data), writer, block_size, count_limit)
+    return writer.getvalue()
+
+def decodeAdaptive(data):
+    '''Decode bytes produced by encodeAdaptive.'''
+    writer = io.BytesIO()
+    decodeAdaptiveStream(io.BytesIO(data), writer)
+    return writer.getvalue()
@@ -0,0 +1,289 @@
+'''This module is a reproducible benchmark suite for the Huffman codecs.
+
+Workloads run on seeded synthetic corpora, or on local copies of the IMDB/CIFAR data cached
+under ./data/corpus so the datasets are only downloaded once. Every benchmark is warmed up,
+repeated and summarized, and results are written as JSON with run metadata so two runs can be
+compared to catch regressions:
+
+    python benchmark.py run --output before.json
+    python benchmark.py run --output after.json
+    python benchmark.py compare before.json after.json
+'''
+import argparse
+import importlib.util
+import json
+import os
+import platform
+import random
+import statistics
+import subprocess
+import sys
+from datetime import datetime, timezone
+from huffmancoding import getFrequency, getHuffmanCodeLengths, canonicalHuffmanCodingFromFrequency, byteHuffmanCoding, buildDecodeTable, encodeToBytes, decodeFromBytes, encodeBytes, decodeBytes
+from adaptivecoding import encodeAdaptive, decodeAdaptive
+from metrics import Timer, measure, getCompressionRatio, getThroughput, enableStages, resetStages, getStageReport
+
+CORPUS_DIRECTORY = os.path.join('./data', 'corpus')
+TEXT_CORPUS_FILE = os.path.join(CORPUS_DIRECTORY, 'imdb_reviews.json')
+IMAGE_CORPUS_FILE = os.path.join(CORPUS_DIRECTORY, 'cifar10.npy')
+# Fraction by which a median time may grow before compare reports a regression.
+DEFAULT_REGRESSION_THRESHOLD = 0.10
+
+
+def getSyntheticText(size, seed=0):
+    '''Generate review-like text from a Zipf-distributed vocabulary of random words.'''
+    generator = random.Random(seed)
+    words = [''.join(generator.choices('etaoinshrdlucmfwypvbgkjqxz', k=generator.randint(1, 9))) for _ in range(5000)]
+    weights = [1 / rank for rank in range(1, len(words) + 1)]
+    reviews = []
+    length = 0
+    while length < size:
+        review = ' '.join(generator.choices(words, weights, k=generator.randint(50, 250))).capitalize() + '. '
+        reviews.append(review)
+        length += len(review)
+    return reviews
+
+def getSyntheticImages(count, seed=0):
+    '''Generate 32x32 RGB images made of smooth gradients plus a little noise.'''
+    import numpy as np
+    generator = np.random.default_rng(seed)
+    rows, columns = np.mgrid[0:32, 0:32]
+    images = []
+    for _ in range(count):
+        slopes = generator.integers(-4, 5, size=(3, 2))
+        offsets = generator.integers(0, 256, size=3)
+        channels = [offsets[c] + slopes[c, 0] * rows + slopes[c, 1] * columns for c in range(3)]
+        noise = generator.integers(0, 4, size=(32, 32, 3))
+        images.append(((np.stack(channels, axis=-1) + noise) % 256).astype(np.uint8))
+    return images
+
+def getCachedText(download=False):
+    '''Get the cached IMDB reviews, downloading and caching them first when download is set.'''
+    if not os.path.exists(TEXT_CORPUS_FILE):
+        if not download:
+            return None
+        from training import getTextTrainingData
+        _, reviews = getTextTrainingData()
+        os.makedirs(CORPUS_DIRECTORY, exist_ok=True)
+        with open(TEXT_CORPUS_FILE, 'w', encoding='utf-8') as file:
+            json.dump(reviews, file, ensure_ascii=False)
+    with open(TEXT_CORPUS_FILE, 'r', encoding='utf-8') as file:
+        return json.load(file)
+
+def getCachedImages(download=False):
+    '''Get the cached CIFAR-10 images, downloading and caching them first when download is set.'''
+    import numpy as np
+    if not os.path.exists(IMAGE_CORPUS_FILE):
+        if not download:
+            return None
+        from training import getImageTrainingImages
+        os.makedirs(CORPUS_DIRECTORY, exist_ok=True)
+        np.save(IMAGE_CORPUS_FILE, np.array(getImageTrainingImages()))
+    return list(np.load(IMAGE_CORPUS_FILE))
+
+def timeRuns(function, warmup, repeats):
+    '''Run function warmup times untimed, then repeats times timed. Return the durations in seconds.'''
+    for _ in range(warmup):
+        function()
+    durations = []
+    for _ in range(repeats):
+        with Timer() as timer:
+            function()
+        durations.append(timer.duration)
+    return durations
+
+def measurePeakMemory(function):
+    '''Run function once under tracemalloc and return its peak traced memory in bytes.'''
+    _, _, _, peak = measure(function, memory=True)
+    return peak
+
+def summarize(durations, size_bytes):
+    '''Summarize repeated durations and the throughput of the median run.'''
+    median = statistics.median(durations)
+    return {
+        'repeats': len(durations),
+        'mean': statistics.mean(durations),
+        'median': median,
+        'stdev': statistics.stdev(durations) if len(durations) > 1 else 0.0,
+        'min': min(durations),
+        'max': max(durations),
+        'size_bytes': size_bytes,
+        'throughput_mb_s': getThroughput(size_bytes, median),
+    }
+
+def runBenchmark(results, name, function, size_bytes, warmup, repeats, memory=False, **extra):
+    '''Time one workload, store its summary in results under name and print a line.'''
+    result = summarize(timeRuns(function, warmup, repeats), size_bytes)
+    if memory:
+        # A separate untimed run, so tracing does not distort the timings.
+        result['peak_memory'] = measurePeakMemory(function)
+    result.update(extra)
+    results[name] = result
+    print(f"{name:<36} median {result['median'] * 1000:10.3f} ms  {result['throughput_mb_s']:8.2f} MB/s")
+
+def benchmarkText(results, reviews, warmup, repeats, memory):
+    '''Benchmark frequency counting, tree building and text encode/decode.'''
+    text = ''.join(reviews)
+    size = len(text.encode('utf-8'))
+    frequency = getFrequency(text)
+    huffman_code = canonicalHuffmanCodingFromFrequency(frequency)
+    decode_table = buildDecodeTable(huffman_code)
+    encoded = encodeToBytes(text, huffman_code)
+    ratio = getCompressionRatio(size, len(encoded))
+
+    runBenchmark(results, 'text.frequency', lambda: getFrequency(text), size, warmup, repeats, memory)
+    runBenchmark(results, 'text.tree_build', lambda: getHuffmanCodeLengths(frequency), size, warmup, repeats, memory, symbols=len(frequency))
+    runBenchmark(results, 'text.encode', lambda: encodeToBytes(text, huffman_code), size, warmup, repeats, memory, compression_ratio=ratio)
+    runBenchmark(results, 'text.decode', lambda: decodeFromBytes(encoded, huffman_code, '', decode_table), size, warmup, repeats, memory)
+    runBenchmark(results, 'text.decode_cold_table', lambda: decodeFromBytes(encoded, huffman_code, '', buildDecodeTable(huffman_code)), size, warmup, repeats, memory)
+    runBenchmark(results, 'text.decode_default', lambda: decodeFromBytes(encoded, huffman_code), size, warmup, repeats, memory)
+
+    data = text.encode('utf-8')
+    byte_code = byteHuffmanCoding(data)
+    byte_table = buildDecodeTable(byte_code)
+    encoded_bytes = encodeBytes(data, byte_code)
+    runBenchmark(results, 'bytes.encode', lambda: encodeBytes(data, byte_code), size, warmup, repeats, memory,
+                 compression_ratio=getCompressionRatio(size, len(encoded_bytes)))
+    runBenchmark(results, 'bytes.decode', lambda: decodeBytes(encoded_bytes, byte_code, byte_table), size, warmup, repeats, memory)
+
+    encoded_adaptive = encodeAdaptive(data)
+    runBenchmark(results, 'adaptive.encode', lambda: encodeAdaptive(data), size, warmup, repeats, memory,
+                 compression_ratio=getCompressionRatio(size, len(encoded_adaptive)))
+    runBenchmark(results, 'adaptive.decode', lambda: decodeAdaptive(encoded_adaptive), size, warmup, repeats, memory)
+
+def benchmarkTreeSizes(results, warmup, repeats, seed):
+    '''Benchmark tree building as the number of distinct symbols grows.
+
+    The size of these workloads is the symbol count, so throughput is in millions of symbols per second.'''
+    generator = random.Random(seed)
+    for symbols in (256, 4096, 65536, 262144):
+        frequency = {symbol: generator.randint(1, 1000) for symbol in range(symbols)}
+        runBenchmark(results, f'tree_build.{symbols}', lambda: getHuffmanCodeLengths(frequency), symbols, warmup, repeats, symbols=symbols)
+
+def benchmarkImages(results, images, warmup, repeats, memory):
+    '''Benchmark the NumPy image path with and without the Paeth filter.
+
+    Small images decode one code at a time; decode_keys_scalar and decode_keys_vectorized time
+    the two key decoders on the same streams.'''
+    import numpy as np
+    from imagecoding import getPixelFrequency, capPixelVocabulary, applyFilter, buildImageCodeTables, encodeImage, decodeImage, decodeKeys, decodeKeysScalar, IMAGE_HEADER
+    size = sum(image.nbytes for image in images)
+    for image_filter in ('none', 'paeth'):
+        residuals = [applyFilter(image, image_filter) for image in images]
+        frequency = capPixelVocabulary(getPixelFrequency(np.concatenate(residuals, axis=0)))
+        huffman_code = canonicalHuffmanCodingFromFrequency(frequency)
+        tables = buildImageCodeTables(huffman_code)
+        encoded = [encodeImage(image, huffman_code, tables, image_filter) for image in images]
+        ratio = getCompressionRatio(size, sum(len(payload) for payload in encoded))
+        runBenchmark(results, f'image.{image_filter}.encode', lambda: [encodeImage(image, huffman_code, tables, image_filter) for image in images],
+                     size, warmup, repeats, memory, compression_ratio=ratio, symbols=len(huffman_code))
+        runBenchmark(results, f'image.{image_filter}.decode', lambda: [decodeImage(payload, huffman_code, tables) for payload in encoded],
+                     size, warmup, repeats, memory)
+        streams = [(np.frombuffer(payload, dtype=np.uint8, offset=IMAGE_HEADER.size), IMAGE_HEADER.unpack_from(payload)[-1], image.shape[0] * image.shape[1])
+                   for payload, image in zip(encoded, images)]
+        runBenchmark(results, f'image.{image_filter}.decode_keys_scalar', lambda: [decodeKeysScalar(*stream, tables) for stream in streams],
+                     size, warmup, repeats, memory)
+        runBenchmark(results, f'image.{image_filter}.decode_keys_vectorized', lambda: [decodeKeys(*stream, tables, scalar_symbols=0) for stream in streams],
+                     size, warmup, repeats, memory)
+
+def getMetadata(arguments):
+    '''Describe the run so results from different versions and machines can be told apart.'''
+    try:
+        commit = subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {
+        'timestamp': datetime.now(timezone.utc).isoformat(),
+        'commit': commit,
+        'python': sys.version.split()[0],
+        'implementation': platform.python_implementation(),
+        'platform': platform.platform(),
+        'processor': platform.processor(),
+        'corpus': arguments.corpus,
+        'size': arguments.size,
+        'seed': arguments.seed,
+        'warmup': arguments.warmup,
+        'repeats': arguments.repeats,
+    }
+
+def runSuite(arguments):
+    '''Run every benchmark and write the JSON report.'''
+    reviews = images = None
+    if arguments.corpus == 'cached':
+        reviews = getCachedText(arguments.download)
+        images = getCachedImages(arguments.download)
+        if reviews is None or images is None:
+            sys.exit("No cached corpus under " + CORPUS_DIRECTORY + ", run with --download once or use --corpus synthetic")
+    else:
+        reviews = getSyntheticText(arguments.size, arguments.seed)
+
+    if arguments.stages:
+        resetStages()
+        enableStages()
+    results = {}
+    benchmarkText(results, reviews, arguments.warmup, arguments.repeats, arguments.memory)
+    benchmarkTreeSizes(results, arguments.warmup, arguments.repeats, arguments.seed)
+    if importlib.util.find_spec('numpy') is None:
+        print("NumPy is not installed, skipping the image benchmarks")
+    else:
+        if images is None:
+            images = getSyntheticImages(max(1, arguments.size // 3072), arguments.seed)
+        benchmarkImages(results, images, arguments.warmup, arguments.repeats, arguments.memory)
+
+    report = {'metadata': getMetadata(arguments), 'results': results}
+    if arguments.stages:
+        enableStages(False)
+        report['stages'] = getStageReport()
+        for name, summary in report['stages'].items():
+            print(f"stage {name:<22} {summary['count']:8d} calls  total {summary['total'] * 1000:10.3f} ms  p99 {summary['p99'] * 1000:8.3f} ms")
+    with open(arguments.output, 'w', encoding='utf-8') as file:
+        json.dump(report, file, indent=2)
+    print("Results written to", arguments.output)
+
+def compareReports(baseline_path, candidate_path, threshold=DEFAULT_REGRESSION_THRESHOLD):
+    '''Print the change in median time of every benchmark and return the names that regressed.'''
+    with open(baseline_path, 'r', encoding='utf-8') as file:
+        baseline = json.load(file)['results']
+    with open(candidate_path, 'r', encoding='utf-8') as file:
+        candidate = json.load(file)['results']
+
+    regressions = []
+    for name in sorted(set(baseline) & set(candidate)):
+        before = baseline[name]['median']
+        after = candidate[name]['median']
+        change = (after - before) / before if before > 0 else 0.0
+        flag = ''
+        if change > threshold:
+            flag = '  REGRESSION'
+            regressions.append(name)
+        print(f"{name:<36} {before * 1000:10.3f} ms -> {after * 1000:10.3f} ms  {change:+8.1%}{flag}")
+    for name in sorted(set(baseline) ^ set(candidate)):
+        print(f"{name:<36} only in {'baseline' if name in baseline else 'candidate'}")
+    return regressions
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the Huffman codecs.")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    run_parser = subparsers.add_parser('run', help="run the benchmark suite")
+    run_parser.add_argument('--output', default='benchmark_results.json', help="JSON report to write")
+    run_parser.add_argument('--corpus', choices=('synthetic', 'cached'), default='synthetic')
+    run_parser.add_argument('--download', action='store_true', help="download and cache the IMDB/CIFAR corpora if missing")
+    run_parser.add_argument('--size', type=int, default=1 << 20, help="approximate synthetic corpus size in bytes")
+    run_parser.add_argument('--seed', type=int, default=0)
+    run_parser.add_argument('--warmup', type=int, default=1)
+    run_parser.add_argument('--repeats', type=int, default=5)
+    run_parser.add_argument('--memory', action='store_true', help="also record peak memory in a separate run")
+    run_parser.add_argument('--stages', action='store_true', help="also report time per codec stage (adds a little overhead to the timings)")
+    compare_parser = subparsers.add_parser('compare', help="compare two JSON reports")
+    compare_parser.add_argument('baseline')
+    compare_parser.add_argument('candidate')
+    compare_parser.add_argument('--threshold', type=float, default=DEFAULT_REGRESSION_THRESHOLD)
+    arguments = parser.parse_args(argv)
+
+    if arguments.command == 'run':
+        runSuite(arguments)
+        return 0
+    return 1 if compareReports(arguments.baseline, arguments.candidate, arguments.threshold) else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
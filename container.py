@@ -0,0 +1,162 @@
+'''This module reads and writes a self-describing compressed container.
+
+A container records everything needed to decode it: the kind of payload, the canonical model
+(embedded, or a CRC32 model id to check a model supplied by the caller), the original length
+and the shape and dtype of images, all covered by a CRC32. The packed blocks follow as a block
+container from the parallel module, whose index carries a CRC32 of itself and of every block.'''
+import struct
+import zlib
+from huffmancoding import byteHuffmanCoding, serializeByteCodeLengths, deserializeByteCodeLengths, serializeCodeLengths, deserializeCodeLengths, getCodeLengths, buildCanonicalCode
+from parallel import splitBlocks, runBlocks, encodeBlock, decodeByteBlock, packBlocks, readBlockIndex, readBlock, DEFAULT_BLOCK_SIZE
+
+# Container header: magic, format version, payload kind, model storage, original length in
+# bytes, size of the model field and number of shape dimensions. The model field, the shape,
+# the dtype name and a CRC32 of everything before it follow.
+CONTAINER_MAGIC = b'HUFZ'
+CONTAINER_VERSION = 2
+CONTAINER_HEADER = struct.Struct('>4sBBBQIB')
+CONTAINER_DIMENSION = struct.Struct('>I')
+CONTAINER_CRC = struct.Struct('>I')
+
+KIND_BYTES = 0
+KIND_IMAGE = 1
+MODEL_EMBEDDED = 0
+MODEL_ID = 1
+
+
+def getModelId(model_data):
+    '''Get the id of a serialized model, used to check that the right model decodes a container.'''
+    return struct.pack('>I', zlib.crc32(model_data))
+
+def packContainer(kind, model_data, embed_model, original_length, shape, dtype, blocks):
+    '''Write a container. blocks is a list of (bit length, packed bits, symbol count).'''
+    model_field = model_data if embed_model else getModelId(model_data)
+    header = bytearray(CONTAINER_HEADER.pack(CONTAINER_MAGIC, CONTAINER_VERSION, kind, MODEL_EMBEDDED if embed_model else MODEL_ID,
+                                             original_length, len(model_field), len(shape)))
+    header += model_field
+    for dimension in shape:
+        header += CONTAINER_DIMENSION.pack(dimension)
+    dtype_name = dtype.encode('ascii')
+    header.append(len(dtype_name))
+    header += dtype_name
+    header += CONTAINER_CRC.pack(zlib.crc32(header))
+    return bytes(header) + packBlocks([(bit_length, packed) for bit_length, packed, _ in blocks], [symbol_count for _, _, symbol_count in blocks])
+
+def readContainer(data):
+    '''Read the header and block index of a container and verify the CRC32 of the header and of every block.
+
+    Returns a dict with the kind, model storage and field, original length, shape, dtype and
+    the list of blocks as (packed bits, bit length, symbol count).'''
+    if len(data) < CONTAINER_HEADER.size:
+        raise ValueError("Container is too short")
+    magic, version, kind, model_type, original_length, model_size, ndim = CONTAINER_HEADER.unpack_from(data)
+    if magic != CONTAINER_MAGIC:
+        raise ValueError("Not a compressed container")
+    if version != CONTAINER_VERSION:
+        raise ValueError(f"Unsupported container version {version}")
+    try:
+        position = CONTAINER_HEADER.size
+        model_field = bytes(data[position:position + model_size])
+        position += model_size
+        shape = []
+        for _ in range(ndim):
+            shape.append(CONTAINER_DIMENSION.unpack_from(data, position)[0])
+            position += CONTAINER_DIMENSION.size
+        dtype_length = data[position]
+        dtype_name = bytes(data[position + 1:position + 1 + dtype_length])
+        position += 1 + dtype_length
+        (crc,) = CONTAINER_CRC.unpack_from(data, position)
+    except (IndexError, struct.error) as error:
+        raise ValueError("Container header is truncated") from error
+    if zlib.crc32(memoryview(data)[:position]) != crc:
+        raise ValueError("Container header failed its CRC32 check")
+    dtype = dtype_name.decode('ascii')
+
+    body = memoryview(data)[position + CONTAINER_CRC.size:]
+    index = readBlockIndex(body)
+    blocks = [(readBlock(body, index, i), bit_length, symbol_count) for i, (_, _, bit_length, symbol_count, _) in enumerate(index)]
+    return {
+        'kind': kind,
+        'model_type': model_type,
+        'model': model_field,
+        'original_length': original_length,
+        'shape': tuple(shape),
+        'dtype': dtype,
+        'blocks': blocks,
+    }
+
+def resolveModel(container, model_data):
+    '''Get the serialized model of a container, checking a caller-supplied model against the stored id.'''
+    if container['model_type'] == MODEL_EMBEDDED:
+        return container['model']
+    if model_data is None:
+        raise ValueError("Container does not embed its model, a model must be supplied")
+    if getModelId(model_data) != container['model']:
+        raise ValueError("Supplied model does not match the model the container was written with")
+    return model_data
+
+def compressBytes(data, byte_code=None, embed_model=True, block_size=DEFAULT_BLOCK_SIZE, max_workers=None):
+    '''Compress bytes into a container. Without a byte code a model is trained on the data itself.'''
+    if byte_code is None:
+        byte_code = byteHuffmanCoding(data)
+    blocks = splitBlocks(data, block_size)
+    encoded_blocks = runBlocks(encodeBlock, blocks, byte_code, max_workers)
+    packed_blocks = [(bit_length, packed, len(block)) for (bit_length, packed), block in zip(encoded_blocks, blocks)]
+    return packContainer(KIND_BYTES, serializeByteCodeLengths(byte_code), embed_model, len(data), (len(data),), 'uint8', packed_blocks)
+
+def decompressBytes(payload, byte_code=None, max_workers=None):
+    '''Decompress a bytes container. byte_code is only needed when the model is not embedded.'''
+    container = readContainer(payload)
+    if container['kind'] != KIND_BYTES:
+        raise ValueError("Container does not hold bytes")
+    model_data = resolveModel(container, None if byte_code is None else serializeByteCodeLengths(byte_code))
+    byte_code = deserializeByteCodeLengths(model_data)
+    packed_blocks = [(packed, bit_length) for packed, bit_length, _ in container['blocks']]
+    decoded_blocks = runBlocks(decodeByteBlock, packed_blocks, byte_code, max_workers)
+    for block, (_, _, symbol_count) in zip(decoded_blocks, container['blocks']):
+        if len(block) != symbol_count:
+            raise ValueError("Decoded block length does not match the block index")
+    data = b''.join(decoded_blocks)
+    if len(data) != container['original_length']:
+        raise ValueError("Decoded length does not match the original length")
+    return data
+
+def compressImage(image, huffman_code, image_filter='none', embed_model=True):
+    '''Compress an (height, width, 3) uint8 image into a container with a pixel model.'''
+    from imagecoding import encodeImage
+    encoded_image = encodeImage(image, huffman_code, image_filter=image_filter)
+    model_data = serializeCodeLengths(getCodeLengths(huffman_code))
+    blocks = [(len(encoded_image) * 8, encoded_image, image.shape[0] * image.shape[1])]
+    return packContainer(KIND_IMAGE, model_data, embed_model, image.nbytes, image.shape, str(image.dtype), blocks)
+
+def decompressImage(payload, huffman_code=None):
+    '''Decompress an image container. huffman_code is only needed when the model is not embedded.'''
+    from imagecoding import decodeImage
+    container = readContainer(payload)
+    if container['kind'] != KIND_IMAGE:
+        raise ValueError("Container does not hold an image")
+    model_data = resolveModel(container, None if huffman_code is None else serializeCodeLengths(getCodeLengths(huffman_code)))
+    huffman_code = buildCanonicalCode(deserializeCodeLengths(model_data))
+    (packed, _, _), = container['blocks']
+    image = decodeImage(packed, huffman_code)
+    if image.shape != container['shape'] or str(image.dtype) != container['dtype']:
+        raise ValueError("Decoded image does not match the recorded shape and dtype")
+    return image
+
+def compressFile(input_path, output_path, byte_code=None, embed_model=True, block_size=DEFAULT_BLOCK_SIZE, max_workers=None):
+    '''Compress a file into a container file. Return the input and output sizes in bytes.'''
+    with open(input_path, 'rb') as file:
+        data = file.read()
+    payload = compressBytes(data, byte_code, embed_model, block_size, max_workers)
+    with open(output_path, 'wb') as file:
+        file.write(payload)
+    return len(data), len(payload)
+
+def decompressFile(input_path, output_path, byte_code=None, max_workers=None):
+    '''Decompress a container file written by compressFile. Return the input and output sizes in bytes.'''
+    with open(input_path, 'rb') as file:
+        payload = file.read()
+    data = decompressBytes(payload, byte_code, max_workers)
+    with open(output_path, 'wb') as file:
+        file.write(data)
+    return len(payload), len(data)
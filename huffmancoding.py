@@ -1,58 +1,586 @@
-import heapq
+import json
+import struct
+from collections import Counter, OrderedDict
+from metrics import getCompressionRatio, Stage
 
+# Header of a packed bitstream: number of valid bits as a big-endian unsigned 64-bit integer.
+BIT_LENGTH_HEADER = struct.Struct('>Q')
 
+# Canonical model file: magic, format version and the largest code length.
+MODEL_MAGIC = b'HUFM'
+MODEL_VERSION = 1
+MODEL_HEADER = struct.Struct('>4sBB')
+
+# Largest alphabet whose decode table keeps a full 256-entry row per state.
+DENSE_DECODE_TABLE_SYMBOLS = 4096
+
+# Decode tables of recently used codes, reused by decode calls that do not pass a table.
+DECODE_TABLE_CACHE_SIZE = 16
+_decode_tables = OrderedDict()
+
+
+@Stage('frequency')
 def getFrequency(text):
     """Get the frequency of each character in the text."""
-    frequency = {}
-    for char in text:
-        if char in frequency:
-            frequency[char] += 1
+    # Count the items of the iterator so a mapping is counted by its keys, not taken as counts.
+    return dict(Counter(iter(text)))
+
+@Stage('frequency')
+def getByteFrequency(data):
+    """Get the frequency of each byte value in bytes or a uint8 array."""
+    import numpy as np
+    counts = np.bincount(np.frombuffer(data, dtype=np.uint8), minlength=256)
+    return {int(byte): int(counts[byte]) for byte in np.flatnonzero(counts)}
+
+def mergeFrequencies(*frequencies):
+    """Merge the frequency dictionaries of several shards into one."""
+    merged = Counter()
+    for frequency in frequencies:
+        merged.update(frequency)
+    return dict(merged)
+
+
+def getHuffmanCodeLengths(frequency):
+    """Get the Huffman code length of every symbol in the frequency dictionary.
+
+    Uses the two-queue construction: leaves are sorted once by (weight, input order) and merged
+    nodes are created in non-decreasing weight order, so both queues stay sorted without a heap
+    and no symbol lists are copied. Code lengths are the node depths, found in one pass from the
+    root since every node is created after its children."""
+    symbols = list(frequency)
+    leaf_count = len(symbols)
+    if leaf_count <= 1:
+        return {char: 1 for char in symbols}
+
+    weights = list(frequency.values())
+    # sorted is stable, so equal weights keep their input order
+    order = sorted(range(leaf_count), key=weights.__getitem__)
+    node_weight = [weights[i] for i in order] + [0] * (leaf_count - 1)
+    parent = [0] * (2 * leaf_count - 1)
+    next_leaf = 0
+    next_merged = leaf_count
+    for node in range(leaf_count, 2 * leaf_count - 1):
+        # Take the two lightest nodes, preferring leaves on equal weights.
+        if next_leaf < leaf_count and (next_merged == node or node_weight[next_leaf] <= node_weight[next_merged]):
+            first = next_leaf
+            next_leaf += 1
+        else:
+            first = next_merged
+            next_merged += 1
+        if next_leaf < leaf_count and (next_merged == node or node_weight[next_leaf] <= node_weight[next_merged]):
+            second = next_leaf
+            next_leaf += 1
         else:
-            frequency[char] = 1
-    return frequency
+            second = next_merged
+            next_merged += 1
+        parent[first] = parent[second] = node
+        node_weight[node] = node_weight[first] + node_weight[second]
+
+    depth = [0] * (2 * leaf_count - 1)
+    for node in range(2 * leaf_count - 3, -1, -1):
+        depth[node] = depth[parent[node]] + 1
+    return {symbols[order[i]]: depth[i] for i in range(leaf_count)}
+
+def getLimitedCodeLengths(frequency, max_length):
+    """Get optimal code lengths of at most max_length bits with the package-merge algorithm.
+
+    Each level merges the sorted leaves with packages of adjacent item pairs from the level
+    below. Taking the 2n - 2 cheapest items of the top level and following the packages back
+    down, every leaf gains one bit per level in which it is taken."""
+    symbols = list(frequency)
+    leaf_count = len(symbols)
+    if (1 << max_length) < leaf_count:
+        raise ValueError(f"{leaf_count} symbols do not fit in codes of at most {max_length} bits")
+    lengths = getHuffmanCodeLengths(frequency)
+    if leaf_count <= 2 or max(lengths.values()) <= max_length:
+        return lengths
+
+    weights = list(frequency.values())
+    order = sorted(range(leaf_count), key=weights.__getitem__)
+    leaf_weights = [weights[i] for i in order]
+    items = leaf_weights
+    leaf_flags = [[True] * leaf_count]
+    for _ in range(max_length - 1):
+        packages = [items[i] + items[i + 1] for i in range(0, len(items) - 1, 2)]
+        merged = []
+        flags = []
+        leaf = package = 0
+        while leaf < leaf_count or package < len(packages):
+            if package == len(packages) or (leaf < leaf_count and leaf_weights[leaf] <= packages[package]):
+                merged.append(leaf_weights[leaf])
+                flags.append(True)
+                leaf += 1
+            else:
+                merged.append(packages[package])
+                flags.append(False)
+                package += 1
+        items = merged
+        leaf_flags.append(flags)
+
+    # levels_taking[i] counts the levels in which exactly the first i leaves were taken
+    levels_taking = [0] * (leaf_count + 1)
+    taken = 2 * leaf_count - 2
+    for flags in reversed(leaf_flags):
+        leaves_taken = sum(flags[:taken])
+        levels_taking[leaves_taken] += 1
+        taken = 2 * (taken - leaves_taken)
+    depth = 0
+    for i in range(leaf_count - 1, -1, -1):
+        depth += levels_taking[i + 1]
+        lengths[symbols[order[i]]] = depth
+    return lengths
+
+def getEncodedBitLength(frequency, code_lengths):
+    """Get the number of bits needed to encode every counted symbol with the given code lengths."""
+    return sum(count * code_lengths[char] for char, count in frequency.items())
+
+def getLengthLimitCost(frequency, max_length, limited_lengths=None):
+    """Get the compression ratio of length-limited codes relative to unrestricted Huffman codes.
 
+    Pass limited_lengths when the max_length code lengths are already computed to skip package-merge."""
+    if limited_lengths is None:
+        limited_lengths = getLimitedCodeLengths(frequency, max_length)
+    unlimited = getEncodedBitLength(frequency, getHuffmanCodeLengths(frequency))
+    limited = getEncodedBitLength(frequency, limited_lengths)
+    return getCompressionRatio(unlimited, limited)
 
+@Stage('tree_build')
 def buildHuffmanTree(frequency):
-    """Build the Huffman tree from the frequency dictionary."""
-    heap = [[weight, [char, ""]] for char, weight in frequency.items()]
-    heapq.heapify(heap)
-    
-    while len(heap) > 1:
-        lo = heapq.heappop(heap)
-     #   print(f'Lowest: {lo}')
-        hi = heapq.heappop(heap)
-
-        for pair in lo[1:]:
-            pair[1] = '0' + pair[1]
-        for pair in hi[1:]:
-            pair[1] = '1' + pair[1]
-        heapq.heappush(heap, [lo[0] + hi[0]] + lo[1:] + hi[1:])
-    item = heapq.heappop(heap)
-    return sorted(item[1:], key=lambda p: (len(p[-1]), p))
+    """Build the Huffman tree from the frequency dictionary.
+
+    Returns [char, code] pairs with canonical codes, sorted by code length and symbol."""
+    huffman_code = buildCanonicalCode(getHuffmanCodeLengths(frequency))
+    return [[char, code] for char, code in huffman_code.items()]
 
 def huffmanCoding(text):
     """Perform Huffman coding on the given text."""
-    frequency = getFrequency(text)
+    return huffmanCodingFromFrequency(getFrequency(text))
+
+def huffmanCodingFromFrequency(frequency):
+    """Perform Huffman coding from an existing frequency dictionary."""
     huffman_tree = buildHuffmanTree(frequency)
     huffman_code = {char: code for char, code in huffman_tree}
     return huffman_code
 
+def getCodeLengths(huffman_code):
+    """Get the code length of every symbol in the Huffman code."""
+    return {char: max(1, len(code)) for char, code in huffman_code.items()}
+
+def buildCanonicalCode(code_lengths):
+    """Assign canonical Huffman codes to symbols ordered by (code length, symbol)."""
+    ordered = sorted(code_lengths)
+    ordered.sort(key=code_lengths.__getitem__)
+    huffman_code = {}
+    code = 0
+    previous_length = 0
+    code_format = ''
+    for char in ordered:
+        length = code_lengths[char]
+        if length != previous_length:
+            code <<= length - previous_length
+            code_format = f'0{length}b'
+            previous_length = length
+        huffman_code[char] = format(code, code_format)
+        code += 1
+    return huffman_code
+
+def canonicalHuffmanCoding(text, max_length=None):
+    """Perform Huffman coding on the given text and return canonical codes, optionally at most max_length bits long."""
+    return canonicalHuffmanCodingFromFrequency(getFrequency(text), max_length)
+
+@Stage('tree_build')
+def canonicalHuffmanCodingFromFrequency(frequency, max_length=None):
+    """Build canonical Huffman codes from an existing frequency dictionary, optionally at most max_length bits long."""
+    if max_length is None:
+        return buildCanonicalCode(getHuffmanCodeLengths(frequency))
+    return buildCanonicalCode(getLimitedCodeLengths(frequency, max_length))
+
+@Stage('encode')
 def encode(text, huffman_code):
     """Encode the text using the Huffman tree."""
-    encoded_text = ''.join(huffman_code[char] for char in text)
+    encoded_text = ''.join(map(huffman_code.__getitem__, text))
     return encoded_text
 
-def decode(encoded_text, huffman_code, separator=''):
-    """Decode the encoded text using the Huffman tree."""
-    reverse_huffman_code = {code: char for char, code in huffman_code.items()}
-    current_code = ""
-    decoded_text = ""
-    for bit in encoded_text:
+def buildDecodeTable(huffman_code):
+    """Build a byte-at-a-time decoding table for the given prefix code.
+
+    Each state is a partial code that has not matched a symbol yet. For a state and an
+    input byte the table holds the symbols completed by that byte and the next state, so
+    the decoder consumes eight bits per step. Transitions are filled in on first use."""
+    # A list is a table indexed by symbol, such as a 256-entry byte code table
+    items = huffman_code.items() if isinstance(huffman_code, dict) else enumerate(huffman_code)
+    reverse_huffman_code = {code: char for char, code in items}
+    # Large alphabets have too many states for a 256-entry row each, so only the
+    # transitions actually used are kept, keyed by (state << 8) | byte.
+    dense = len(reverse_huffman_code) <= DENSE_DECODE_TABLE_SYMBOLS
+    return {
+        'reverse': reverse_huffman_code,
+        'prefixes': [''],
+        'states': {'': 0},
+        'rows': [[None] * 256] if dense else None,
+        'transitions': None if dense else {},
+        # Per separator, the same transitions with the completed symbols already joined.
+        'text': {},
+        # Set once fillDecodeTable has built every transition.
+        'filled': False,
+    }
+
+def getCachedDecodeTable(huffman_code):
+    """Get the decode table of a code from a small LRU cache, building it on a miss.
+
+    Tables are keyed by the content of the code, so a warm table is shared by every decode
+    call with an equal code, including the tables modelcache.getDecodeTable fills in."""
+    key = tuple(huffman_code.items()) if isinstance(huffman_code, dict) else tuple(huffman_code)
+    decode_table = _decode_tables.get(key)
+    if decode_table is None:
+        decode_table = _decode_tables[key] = buildDecodeTable(huffman_code)
+        if len(_decode_tables) > DECODE_TABLE_CACHE_SIZE:
+            _decode_tables.popitem(last=False)
+    else:
+        _decode_tables.move_to_end(key)
+    return decode_table
+
+def buildTransition(decode_table, state, byte):
+    """Compute and store the table entry for reading byte while in state."""
+    reverse_huffman_code = decode_table['reverse']
+    current_code = decode_table['prefixes'][state]
+    completed = []
+    for bit in format(byte, '08b'):
         current_code += bit
         if current_code in reverse_huffman_code:
-            decoded_text += (separator + reverse_huffman_code[current_code]) if len(decoded_text) > 0 else reverse_huffman_code[current_code]
+            completed.append(reverse_huffman_code[current_code])
             current_code = ""
-    return decoded_text
+    rows = decode_table['rows']
+    next_state = decode_table['states'].get(current_code)
+    if next_state is None:
+        next_state = len(decode_table['prefixes'])
+        decode_table['states'][current_code] = next_state
+        decode_table['prefixes'].append(current_code)
+        if rows is not None:
+            rows.append([None] * 256)
+    entry = (completed, next_state)
+    if rows is not None:
+        rows[state][byte] = entry
+    else:
+        decode_table['transitions'][(state << 8) | byte] = entry
+    return entry
+
+def fillDecodeTable(decode_table):
+    """Build every transition of a dense decode table up front instead of on first use.
+
+    Sparse tables of large alphabets are left to fill on use, most of their (state, byte) pairs
+    never occur. States that are not a prefix of any code only come from invalid input and are
+    not expanded either."""
+    rows = decode_table['rows']
+    if rows is None or decode_table['filled']:
+        return decode_table
+    code_prefixes = {code[:length] for code in decode_table['reverse'] for length in range(len(code))}
+    state = 0
+    while state < len(rows):
+        if decode_table['prefixes'][state] in code_prefixes:
+            row = rows[state]
+            for byte in range(256):
+                if row[byte] is None:
+                    buildTransition(decode_table, state, byte)
+        state += 1
+    decode_table['filled'] = True
+    return decode_table
+
+@Stage('decode')
+def decodePackedSymbols(packed, bit_length, decode_table):
+    """Decode the first bit_length bits of a packed bitstream into a list of symbols.
+
+    Trailing bits that do not form a complete code are ignored."""
+    full_bytes = bit_length // 8
+    rows = decode_table['rows']
+    symbols = []
+    extend = symbols.extend
+    state = 0
+    if rows is not None:
+        for byte in packed[:full_bytes]:
+            entry = rows[state][byte]
+            if entry is None:
+                entry = buildTransition(decode_table, state, byte)
+            completed, state = entry
+            extend(completed)
+    else:
+        transitions = decode_table['transitions']
+        for byte in packed[:full_bytes]:
+            entry = transitions.get((state << 8) | byte)
+            if entry is None:
+                entry = buildTransition(decode_table, state, byte)
+            completed, state = entry
+            extend(completed)
+
+    remaining_bits = bit_length - full_bytes * 8
+    if remaining_bits:
+        reverse_huffman_code = decode_table['reverse']
+        current_code = decode_table['prefixes'][state]
+        for bit in format(packed[full_bytes], '08b')[:remaining_bits]:
+            current_code += bit
+            if current_code in reverse_huffman_code:
+                symbols.append(reverse_huffman_code[current_code])
+                current_code = ""
+    return symbols
+
+def buildTextTransition(decode_table, text_table, separator, state, byte):
+    """Compute and store the joined-text entry for reading byte while in state."""
+    rows = decode_table['rows']
+    if rows is not None:
+        entry = rows[state][byte]
+    else:
+        entry = decode_table['transitions'].get((state << 8) | byte)
+    if entry is None:
+        entry = buildTransition(decode_table, state, byte)
+    completed, next_state = entry
+    text_entry = (''.join(symbol + separator for symbol in completed), next_state)
+    if rows is not None:
+        # Keep a text row for every state the symbol table knows.
+        text_table.extend([None] * 256 for _ in range(len(rows) - len(text_table)))
+        text_table[state][byte] = text_entry
+    else:
+        text_table[(state << 8) | byte] = text_entry
+    return text_entry
+
+@Stage('decode')
+def decodePackedText(packed, bit_length, decode_table, separator=''):
+    """Decode the first bit_length bits of a packed bitstream into a string of symbols joined by separator.
+
+    Same as separator.join(decodePackedSymbols(...)) for string symbols, but every table entry
+    holds its symbols already joined, so each input byte costs a single append."""
+    full_bytes = bit_length // 8
+    rows = decode_table['rows']
+    text_table = decode_table['text'].get(separator)
+    if text_table is None:
+        text_table = decode_table['text'][separator] = [] if rows is not None else {}
+    parts = []
+    append = parts.append
+    state = 0
+    if rows is not None:
+        if len(text_table) < len(rows):
+            text_table.extend([None] * 256 for _ in range(len(rows) - len(text_table)))
+        for byte in packed[:full_bytes]:
+            entry = text_table[state][byte]
+            if entry is None:
+                entry = buildTextTransition(decode_table, text_table, separator, state, byte)
+            text, state = entry
+            append(text)
+    else:
+        for byte in packed[:full_bytes]:
+            entry = text_table.get((state << 8) | byte)
+            if entry is None:
+                entry = buildTextTransition(decode_table, text_table, separator, state, byte)
+            text, state = entry
+            append(text)
+
+    remaining_bits = bit_length - full_bytes * 8
+    if remaining_bits:
+        reverse_huffman_code = decode_table['reverse']
+        current_code = decode_table['prefixes'][state]
+        for bit in format(packed[full_bytes], '08b')[:remaining_bits]:
+            current_code += bit
+            if current_code in reverse_huffman_code:
+                append(reverse_huffman_code[current_code] + separator)
+                current_code = ""
+    text = ''.join(parts)
+    if separator and text:
+        text = text[:-len(separator)]
+    return text
+
+def decodeSymbols(encoded_text, huffman_code, decode_table=None):
+    """Decode the encoded text into a list of symbols."""
+    if decode_table is None:
+        decode_table = getCachedDecodeTable(huffman_code)
+    return decodePackedSymbols(packBits(encoded_text), len(encoded_text), decode_table)
+
+def decode(encoded_text, huffman_code, separator='', decode_table=None):
+    """Decode the encoded text using the Huffman tree."""
+    if decode_table is None:
+        decode_table = getCachedDecodeTable(huffman_code)
+    return decodePackedText(packBits(encoded_text), len(encoded_text), decode_table, separator)
+
+@Stage('pack')
+def packBits(encoded_text):
+    """Pack a string of '0'/'1' characters into bytes, padding the last byte with zeros."""
+    bit_length = len(encoded_text)
+    padding = (-bit_length) % 8
+    if bit_length == 0:
+        return b''
+    return int(encoded_text + '0' * padding, 2).to_bytes((bit_length + padding) // 8, 'big')
+
+@Stage('pack')
+def unpackBits(packed, bit_length):
+    """Unpack bytes into a string of '0'/'1' characters, dropping the padding bits."""
+    if bit_length == 0:
+        return ''
+    bits = bin(int.from_bytes(packed, 'big'))[2:].zfill(len(packed) * 8)
+    return bits[:bit_length]
+
+def encodeToBytes(text, huffman_code):
+    """Encode the text into a packed bitstream prefixed with its bit length."""
+    encoded_text = encode(text, huffman_code)
+    return BIT_LENGTH_HEADER.pack(len(encoded_text)) + packBits(encoded_text)
+
+def decodeFromBytes(data, huffman_code, separator='', decode_table=None):
+    """Decode a packed bitstream produced by encodeToBytes."""
+    if len(data) < BIT_LENGTH_HEADER.size:
+        raise ValueError("Packed data is too short to contain a bit length header")
+    (bit_length,) = BIT_LENGTH_HEADER.unpack_from(data)
+    packed = data[BIT_LENGTH_HEADER.size:]
+    if len(packed) * 8 < bit_length:
+        raise ValueError("Packed data is truncated")
+    if decode_table is None:
+        decode_table = getCachedDecodeTable(huffman_code)
+    return decodePackedText(packed, bit_length, decode_table, separator)
+
+def byteHuffmanCoding(data, smoothing=1):
+    """Build a 256-entry code table indexed by byte value from bytes such as UTF-8 text."""
+    return byteHuffmanCodingFromFrequency(getByteFrequency(data), smoothing)
+
+def byteHuffmanCodingFromFrequency(frequency, smoothing=1):
+    """Build a 256-entry code table from byte counts.
+
+    smoothing is added to every count so that bytes never seen in training still get a code."""
+    if smoothing < 1:
+        raise ValueError("smoothing must be at least 1 so every byte has a code")
+    smoothed = {byte: frequency.get(byte, 0) + smoothing for byte in range(256)}
+    huffman_code = canonicalHuffmanCodingFromFrequency(smoothed)
+    return [huffman_code[byte] for byte in range(256)]
+
+def buildByteDecodeTable(byte_code):
+    """Build the decode table of a 256-entry byte code table."""
+    return buildDecodeTable(byte_code)
+
+def encodeBytes(data, byte_code):
+    """Encode bytes with a 256-entry code table into a packed bitstream prefixed with its bit length."""
+    return encodeToBytes(data, byte_code)
+
+def decodeBytes(data, byte_code, decode_table=None):
+    """Decode a packed bitstream produced by encodeBytes back into bytes."""
+    if len(data) < BIT_LENGTH_HEADER.size:
+        raise ValueError("Packed data is too short to contain a bit length header")
+    (bit_length,) = BIT_LENGTH_HEADER.unpack_from(data)
+    packed = data[BIT_LENGTH_HEADER.size:]
+    if len(packed) * 8 < bit_length:
+        raise ValueError("Packed data is truncated")
+    if decode_table is None:
+        decode_table = getCachedDecodeTable(byte_code)
+    return bytes(decodePackedSymbols(packed, bit_length, decode_table))
+
+def serializeByteCodeLengths(byte_code):
+    """Serialize a 256-entry byte code table as one code length byte per byte value."""
+    return bytes(len(code) for code in byte_code)
+
+def deserializeByteCodeLengths(data):
+    """Rebuild the canonical 256-entry byte code table from serialized code lengths."""
+    if len(data) != 256:
+        raise ValueError("A byte model must hold exactly 256 code lengths")
+    huffman_code = buildCanonicalCode(dict(enumerate(data)))
+    return [huffman_code[byte] for byte in range(256)]
+
+def writeByteModelToFile(byte_code, filename):
+    """Write a 256-entry byte code table to a binary model file."""
+    with open(filename, 'wb') as file:
+        file.write(serializeByteCodeLengths(byte_code))
+
+def readByteModelFromFile(filename):
+    """Read a binary byte model file and rebuild the canonical code table."""
+    with open(filename, 'rb') as file:
+        return deserializeByteCodeLengths(file.read())
+
+def writeVarint(buffer, value):
+    """Append value to the buffer as a little-endian base-128 varint."""
+    while value >= 0x80:
+        buffer.append((value & 0x7F) | 0x80)
+        value >>= 7
+    buffer.append(value)
+
+def readVarint(data, position):
+    """Read a varint from data at position, return the value and the next position."""
+    value = 0
+    shift = 0
+    while True:
+        byte = data[position]
+        position += 1
+        value |= (byte & 0x7F) << shift
+        if byte < 0x80:
+            return value, position
+        shift += 7
+
+def serializeCodeLengths(code_lengths):
+    """Serialize a symbol to code length map into the compact canonical model format.
+
+    Symbols are written in canonical order, grouped by code length, so only the number
+    of symbols per length and the UTF-8 symbols themselves need to be stored."""
+    ordered = sorted(code_lengths.items(), key=lambda p: (p[1], p[0]))
+    max_length = ordered[-1][1] if ordered else 0
+    if max_length > 255:
+        raise ValueError("Code lengths above 255 bits cannot be serialized")
+    counts = [0] * (max_length + 1)
+    for _, length in ordered:
+        counts[length] += 1
+
+    buffer = bytearray(MODEL_HEADER.pack(MODEL_MAGIC, MODEL_VERSION, max_length))
+    for count in counts[1:]:
+        writeVarint(buffer, count)
+    for char, _ in ordered:
+        symbol = char.encode('utf-8')
+        writeVarint(buffer, len(symbol))
+        buffer += symbol
+    return bytes(buffer)
+
+def deserializeCodeLengths(data):
+    """Read a symbol to code length map from the compact canonical model format.
+
+    Raise ValueError when the data is truncated or followed by trailing bytes."""
+    if len(data) < MODEL_HEADER.size:
+        raise ValueError("Model data is too short")
+    magic, version, max_length = MODEL_HEADER.unpack_from(data)
+    if magic != MODEL_MAGIC:
+        raise ValueError("Not a canonical Huffman model")
+    if version != MODEL_VERSION:
+        raise ValueError(f"Unsupported model version {version}")
+
+    position = MODEL_HEADER.size
+    counts = []
+    code_lengths = {}
+    try:
+        for _ in range(max_length):
+            count, position = readVarint(data, position)
+            counts.append(count)
+
+        for length, count in enumerate(counts, start=1):
+            for _ in range(count):
+                size, position = readVarint(data, position)
+                if position + size > len(data):
+                    raise IndexError(position + size)
+                code_lengths[bytes(data[position:position + size]).decode('utf-8')] = length
+                position += size
+    except IndexError as error:
+        raise ValueError("Model data is truncated") from error
+    if position != len(data):
+        raise ValueError("Model data has trailing bytes")
+    return code_lengths
+
+def writeCanonicalModelToFile(huffman_code, filename):
+    """Write the code lengths of the Huffman code to a binary model file."""
+    with open(filename, 'wb') as file:
+        file.write(serializeCodeLengths(getCodeLengths(huffman_code)))
+
+def readCanonicalModelFromFile(filename):
+    """Read a binary model file and rebuild the canonical Huffman code."""
+    with open(filename, 'rb') as file:
+        return buildCanonicalCode(deserializeCodeLengths(file.read()))
+
+def writeFrequencyToFile(frequency, filename):
+    """Write a frequency dictionary to a JSON file so a model can be updated later."""
+    with open(filename, 'w', encoding="utf-8") as file:
+        json.dump(frequency, file, ensure_ascii=False)
+
+def readFrequencyFromFile(filename):
+    """Read a frequency dictionary written by writeFrequencyToFile."""
+    with open(filename, 'r', encoding="utf-8") as file:
+        return json.load(file)
 
 def writeHuffmanCodeToFile(huffman_code, filename):
     """Write the Huffman code to a file."""
@@ -74,4 +602,7 @@ if __name__ == "__main__":
     text = "hello world"
     huffman_code = huffmanCoding(text)
     print("Huffman Code: ", huffman_code)
+    packed = encodeToBytes(text, huffman_code)
+    print("Packed size(bytes): ", len(packed))
+    print("Decoded: ", decodeFromBytes(packed, huffman_code))
     
\ No newline at end of file
@@ -0,0 +1,429 @@
+'''This module encodes and decodes uint8 RGB images directly as NumPy arrays.
+
+Pixels are looked up in array-indexed code tables built from an "r-g-b" pixel model, so no
+per-pixel Python strings are created. Codes are assigned canonically from the model's code
+lengths, which matches huffmancoding.buildCanonicalCode for the same model.'''
+import struct
+import numpy as np
+from huffmancoding import getCodeLengths, buildCanonicalCode
+from metrics import Stage
+
+# Encoded image: magic, format version, prediction filter, height, width and number of valid bits.
+IMAGE_MAGIC = b'HUFI'
+IMAGE_VERSION = 2
+IMAGE_HEADER = struct.Struct('>4sBBIIQ')
+
+# Prediction filters applied before coding, by name and by the id stored in the header.
+IMAGE_FILTERS = {'none': 0, 'delta': 1, 'paeth': 2}
+
+# Symbol emitted before a pixel that is not in the model, followed by the raw pixel value.
+ESCAPE_PIXEL = 'ESC'
+ESCAPE_RAW_BITS = 24
+# Key of the escape symbol in the code tables, just past the 24-bit pixel range.
+ESCAPE_KEY = 1 << 24
+# Largest number of pixel symbols kept in a trained image model.
+DEFAULT_MAX_PIXEL_SYMBOLS = 1 << 16
+# Bits resolved by one decode lookup table gather; longer codes are matched by length.
+DECODE_LOOKUP_BITS = 20
+# Bits decoded per group, which bounds the decoder's temporary arrays.
+DECODE_GROUP_BITS = 1 << 22
+# Bits per segment decoded in lockstep within a group.
+DECODE_SEGMENT_BITS = 1 << 12
+# Streams of at most this many pixels are decoded one code at a time, which beats the vectorized
+# decoder's per-step NumPy overhead on small images.
+DECODE_SCALAR_SYMBOLS = 1 << 14
+
+
+def pixelToKey(pixel):
+    '''Convert an "r-g-b" pixel string to its 24-bit integer key.'''
+    if pixel == ESCAPE_PIXEL:
+        return ESCAPE_KEY
+    red, green, blue = (int(channel) for channel in pixel.split('-'))
+    return (red << 16) | (green << 8) | blue
+
+def keyToPixel(key):
+    '''Convert a 24-bit integer key back to an "r-g-b" pixel string.'''
+    return f"{(key >> 16) & 0xFF}-{(key >> 8) & 0xFF}-{key & 0xFF}"
+
+def imageToKeys(image):
+    '''Combine the channels of an (height, width, 3) uint8 image into one 24-bit key per pixel.'''
+    image = np.asarray(image, dtype=np.uint8)
+    if image.ndim != 3 or image.shape[2] != 3:
+        raise ValueError(f"Expected an RGB image of shape (height, width, 3), got {image.shape}")
+    pixels = image.reshape(-1, 3).astype(np.uint32)
+    return (pixels[:, 0] << 16) | (pixels[:, 1] << 8) | pixels[:, 2]
+
+def keysToImage(keys, height, width):
+    '''Split 24-bit pixel keys back into an (height, width, 3) uint8 image.'''
+    image = np.empty((keys.size, 3), dtype=np.uint8)
+    image[:, 0] = keys >> 16
+    image[:, 1] = keys >> 8
+    image[:, 2] = keys
+    return image.reshape(height, width, 3)
+
+@Stage('frequency')
+def getPixelFrequency(image):
+    '''Get the frequency of each "r-g-b" pixel in an image without building per-pixel strings.'''
+    keys, counts = np.unique(imageToKeys(image), return_counts=True)
+    return {keyToPixel(int(key)): int(count) for key, count in zip(keys, counts)}
+
+def paethPredictor(left, up, up_left):
+    '''Predict each value from its left, upper and upper-left neighbours as in the PNG Paeth filter.'''
+    left = left.astype(np.int16)
+    up = up.astype(np.int16)
+    up_left = up_left.astype(np.int16)
+    estimate = left + up - up_left
+    distance_left = np.abs(estimate - left)
+    distance_up = np.abs(estimate - up)
+    distance_up_left = np.abs(estimate - up_left)
+    return np.where((distance_left <= distance_up) & (distance_left <= distance_up_left), left,
+                    np.where(distance_up <= distance_up_left, up, up_left)).astype(np.uint8)
+
+def applyFilter(image, image_filter='none'):
+    '''Replace every value of an (height, width, channels) uint8 image by its prediction residual.
+
+    "delta" predicts each value from its left neighbour in the same channel, "paeth" uses the
+    PNG Paeth predictor. Residuals wrap modulo 256, so the result is still uint8.'''
+    image = np.asarray(image, dtype=np.uint8)
+    if image_filter == 'none':
+        return image
+    if image_filter == 'delta':
+        residual = image.copy()
+        residual[:, 1:] -= image[:, :-1]
+        return residual
+    if image_filter == 'paeth':
+        padded = np.pad(image, ((1, 0), (1, 0), (0, 0)))
+        return image - paethPredictor(padded[1:, :-1], padded[:-1, 1:], padded[:-1, :-1])
+    raise ValueError(f"Unknown image filter {image_filter!r}")
+
+def invertFilter(residual, image_filter='none'):
+    '''Rebuild the image from the residuals produced by applyFilter.'''
+    residual = np.asarray(residual, dtype=np.uint8)
+    if image_filter == 'none':
+        return residual
+    if image_filter == 'delta':
+        return np.cumsum(residual, axis=1, dtype=np.uint8)
+    if image_filter == 'paeth':
+        # A pixel only depends on earlier anti-diagonals, so each diagonal is restored at once.
+        height, width = residual.shape[:2]
+        padded = np.zeros((height + 1, width + 1) + residual.shape[2:], dtype=np.uint8)
+        for diagonal in range(height + width - 1):
+            rows = np.arange(max(0, diagonal - width + 1), min(height, diagonal + 1))
+            columns = diagonal - rows
+            prediction = paethPredictor(padded[rows + 1, columns], padded[rows, columns + 1], padded[rows, columns])
+            padded[rows + 1, columns + 1] = residual[rows, columns] + prediction
+        return padded[1:, 1:]
+    raise ValueError(f"Unknown image filter {image_filter!r}")
+
+def capPixelVocabulary(frequency, max_symbols=DEFAULT_MAX_PIXEL_SYMBOLS):
+    '''Keep the max_symbols most frequent pixels and add the escape symbol.
+
+    The escape symbol takes the combined count of the dropped pixels (at least 1), so the
+    model can encode any pixel while its size and lookup cost stay bounded.'''
+    ranked = sorted(frequency.items(), key=lambda p: (-p[1], p[0]))
+    capped = dict(ranked[:max_symbols])
+    capped[ESCAPE_PIXEL] = max(1, sum(count for _, count in ranked[max_symbols:]))
+    return capped
+
+def buildImageCodeTables(huffman_code):
+    '''Build the array code tables for a pixel model.
+
+    Encoding uses the pixel keys sorted for np.searchsorted with the matching code values and
+    lengths. Decoding uses, for every code length, the first canonical code, the number of
+    codes and the offset of their pixels in canonical order.'''
+    canonical_code = buildCanonicalCode(getCodeLengths(huffman_code))
+    canonical_keys = np.array([pixelToKey(pixel) for pixel in canonical_code], dtype=np.uint32)
+    canonical_lengths = np.array([len(code) for code in canonical_code.values()], dtype=np.uint8)
+    canonical_values = np.array([int(code, 2) for code in canonical_code.values()], dtype=np.uint64)
+    max_length = int(canonical_lengths.max()) if canonical_lengths.size else 0
+    # A code read at any bit offset must fit in one 64-bit word.
+    if max_length > 57:
+        raise ValueError("Codes longer than 57 bits are not supported")
+
+    escape = np.flatnonzero(canonical_keys == ESCAPE_KEY)
+    if escape.size and int(canonical_lengths[escape[0]]) + ESCAPE_RAW_BITS > 64:
+        raise ValueError("Escape code is too long to combine with a raw pixel value")
+
+    order = np.argsort(canonical_keys)
+    counts = np.bincount(canonical_lengths, minlength=max_length + 1)
+    offsets = np.concatenate(([0], np.cumsum(counts)[:-1]))
+    first_codes = np.zeros(max_length + 1, dtype=np.uint64)
+    # Every lookup_bits-bit value whose prefix is a code of at most lookup_bits bits maps to
+    # that code's length and canonical index; length 0 marks a longer code.
+    lookup_bits = max(1, min(max_length, DECODE_LOOKUP_BITS))
+    lookup_lengths = np.zeros(1 << lookup_bits, dtype=np.uint8)
+    lookup_symbols = np.zeros(1 << lookup_bits, dtype=np.int32)
+    for length in range(1, max_length + 1):
+        if counts[length]:
+            first_codes[length] = canonical_values[offsets[length]]
+            if length <= lookup_bits:
+                spread = lookup_bits - length
+                start = int(first_codes[length]) << spread
+                entries = np.arange(int(counts[length]) << spread)
+                lookup_lengths[start:start + entries.size] = length
+                lookup_symbols[start:start + entries.size] = int(offsets[length]) + (entries >> spread)
+    return {
+        'keys': canonical_keys[order],
+        'codes': canonical_values[order],
+        'lengths': canonical_lengths[order],
+        'canonical_keys': canonical_keys,
+        'first_codes': first_codes,
+        'counts': counts,
+        'offsets': offsets,
+        'max_length': max_length,
+        'lookup_bits': lookup_bits,
+        'lookup_lengths': lookup_lengths,
+        'lookup_symbols': lookup_symbols,
+        'escape_index': int(escape[0]) if escape.size else None,
+        'escape_code': int(canonical_values[escape[0]]) if escape.size else None,
+        'escape_length': int(canonical_lengths[escape[0]]) if escape.size else None,
+    }
+
+@Stage('encode')
+def lookupCodes(keys, tables):
+    '''Find the code value and length of every pixel key.
+
+    Pixels missing from the model are coded as the escape code followed by the raw 24-bit
+    pixel value. Without an escape symbol in the model they raise KeyError.'''
+    index = np.searchsorted(tables['keys'], keys)
+    index[index == tables['keys'].size] = 0
+    missing = tables['keys'][index] != keys
+    codes = tables['codes'][index]
+    lengths = tables['lengths'][index].astype(np.int64)
+    if np.any(missing):
+        if tables['escape_code'] is None:
+            raise KeyError(keyToPixel(int(keys[np.argmax(missing)])))
+        escape_prefix = np.uint64(tables['escape_code'] << ESCAPE_RAW_BITS)
+        codes[missing] = escape_prefix | keys[missing].astype(np.uint64)
+        lengths[missing] = tables['escape_length'] + ESCAPE_RAW_BITS
+    return codes, lengths
+
+@Stage('pack')
+def packCodes(codes, lengths):
+    '''Concatenate variable-length codes into a packed bitstream, return it with its bit length.'''
+    lengths = lengths.astype(np.int64)
+    ends = np.cumsum(lengths)
+    bit_length = int(ends[-1]) if ends.size else 0
+    starts = ends - lengths
+    bits = np.zeros(bit_length, dtype=np.uint8)
+    for bit in range(int(lengths.max()) if lengths.size else 0):
+        present = lengths > bit
+        shift = (lengths[present] - 1 - bit).astype(np.uint64)
+        bits[starts[present] + bit] = (codes[present] >> shift) & np.uint64(1)
+    return np.packbits(bits).tobytes(), bit_length
+
+def readWords(padded, first, count):
+    '''Read the 64-bit big-endian word starting at each of count bytes from byte first of a zero-padded array.'''
+    words = np.zeros(count, dtype=np.uint64)
+    for byte in range(8):
+        words = (words << np.uint64(8)) | padded[first + byte:first + byte + count]
+    return words
+
+def readBitWindows(words, first_bit, positions, width):
+    '''Read the width-bit value starting at every bit position, at most 57 bits.
+
+    words holds the 64-bit word of every byte from bit first_bit on, as built by readWords.'''
+    relative = positions - first_bit
+    shift = (64 - width - (relative & 7)).astype(np.uint64)
+    return (words[relative >> 3] >> shift) & np.uint64((1 << width) - 1)
+
+def getCodeLengthsAt(words, first_bit, positions, tables):
+    '''Find the length and canonical index of the code starting at every bit position.
+
+    Codes of up to lookup_bits bits come from one lookup table gather, longer ones are matched
+    against the canonical code ranges. Escaped pixels include their raw bits in the length.
+    Positions where no code matches get length 0.'''
+    lookup_bits = tables['lookup_bits']
+    windows = readBitWindows(words, first_bit, positions, lookup_bits).astype(np.int64)
+    lengths = tables['lookup_lengths'][windows].astype(np.int64)
+    symbols = tables['lookup_symbols'][windows].astype(np.int64)
+
+    max_length = tables['max_length']
+    long_codes = np.flatnonzero(lengths == 0)
+    if long_codes.size and max_length > lookup_bits:
+        long_windows = readBitWindows(words, first_bit, positions[long_codes], max_length)
+        for length in range(lookup_bits + 1, max_length + 1):
+            count = int(tables['counts'][length])
+            if count == 0:
+                continue
+            relative = (long_windows >> np.uint64(max_length - length)).astype(np.int64) - int(tables['first_codes'][length])
+            match = (lengths[long_codes] == 0) & (relative >= 0) & (relative < count)
+            lengths[long_codes[match]] = length
+            symbols[long_codes[match]] = int(tables['offsets'][length]) + relative[match]
+    if tables['escape_index'] is not None:
+        lengths[symbols == tables['escape_index']] += ESCAPE_RAW_BITS
+    return lengths, symbols
+
+def traceSegments(words, first_bit, starts, ends, tables):
+    '''Decode every segment in lockstep from its start until a code starts at or past its end.
+
+    Returns the code starts as a (steps, segments) array padded with -1 and the position where
+    each segment's last code ends. An invalid code ends its segment; the chain check in
+    decodeKeys rejects the stream if that code is really used.'''
+    positions = starts.copy()
+    rows = []
+    active = np.flatnonzero(positions < ends)
+    while active.size:
+        current = positions[active]
+        row = np.full(starts.size, -1, dtype=np.int64)
+        row[active] = current
+        rows.append(row)
+        lengths, _ = getCodeLengthsAt(words, first_bit, current, tables)
+        invalid = lengths == 0
+        lengths[invalid] = ends[active[invalid]] - current[invalid]
+        positions[active] = current + lengths
+        active = active[positions[active] < ends[active]]
+    code_starts = np.stack(rows) if rows else np.full((0, starts.size), -1, dtype=np.int64)
+    return code_starts, positions
+
+def decodeCodeStarts(words, first_bit, entry, end, tables, segment_bits):
+    '''Find the start of every code between entry and end, return them and where the last code ends.
+
+    The range is cut into segments decoded in parallel, each speculatively from its first bit.
+    Huffman codes resynchronize within a few codes, so once the real chain coming from the
+    previous segment reaches a position that segment also decoded, the rest of its codes are
+    right. Segments that never resynchronize are decoded again from the real entry point.'''
+    guesses = np.arange(entry, end, segment_bits, dtype=np.int64)
+    ends = np.append(guesses[1:], end)
+    code_starts, last_ends = traceSegments(words, first_bit, guesses, ends, tables)
+    while True:
+        entries = np.concatenate(([entry], last_ends[:-1]))
+        synchronized = np.any(code_starts == entries, axis=0) | (entries == guesses)
+        if np.all(synchronized):
+            break
+        # Only the first unsynchronized segment is known to have a correct entry, but redoing
+        # all of them at once usually fixes every segment in a single pass.
+        redo = np.flatnonzero(~synchronized)
+        guesses[redo] = entries[redo]
+        redo_starts, last_ends[redo] = traceSegments(words, first_bit, guesses[redo], ends[redo], tables)
+        steps = max(code_starts.shape[0], redo_starts.shape[0])
+        code_starts = np.concatenate((code_starts, np.full((steps - code_starts.shape[0], guesses.size), -1, dtype=np.int64)))
+        code_starts[:, redo] = -1
+        code_starts[:redo_starts.shape[0], redo] = redo_starts
+    used = code_starts.T >= entries[:, None]
+    return code_starts.T[used], int(last_ends[-1])
+
+def decodeKeysScalar(packed, bit_length, symbol_count, tables):
+    '''Decode symbol_count canonical codes from a packed bitstream into 24-bit pixel keys, one code at a time.'''
+    data = bytes(packed) + bytes(16)
+    from_bytes = int.from_bytes
+    lookup_bits = tables['lookup_bits']
+    lookup_mask = (1 << lookup_bits) - 1
+    lookup_lengths = memoryview(tables['lookup_lengths'])
+    lookup_symbols = memoryview(tables['lookup_symbols'])
+    max_length = tables['max_length']
+    long_lengths = [(length, int(tables['first_codes'][length]), int(tables['counts'][length]), int(tables['offsets'][length]))
+                    for length in range(lookup_bits + 1, max_length + 1) if tables['counts'][length]]
+    escape_index = tables['escape_index']
+    symbols = [0] * symbol_count
+    raw_values = {}
+    position = 0
+    for i in range(symbol_count):
+        word = from_bytes(data[position >> 3:(position >> 3) + 8], 'big')
+        offset = position & 7
+        window = (word >> (64 - lookup_bits - offset)) & lookup_mask
+        length = lookup_lengths[window]
+        if length:
+            symbol = lookup_symbols[window]
+        else:
+            for length, first_code, count, first_symbol in long_lengths:
+                relative = ((word >> (64 - length - offset)) & ((1 << length) - 1)) - first_code
+                if 0 <= relative < count:
+                    symbol = first_symbol + relative
+                    break
+            else:
+                raise ValueError("Corrupt image data")
+        position += length
+        if symbol == escape_index:
+            raw_word = from_bytes(data[position >> 3:(position >> 3) + 8], 'big')
+            raw_values[i] = (raw_word >> (64 - ESCAPE_RAW_BITS - (position & 7))) & (ESCAPE_KEY - 1)
+            position += ESCAPE_RAW_BITS
+        symbols[i] = symbol
+        if position > bit_length:
+            raise ValueError("Corrupt image data")
+    if position != bit_length:
+        raise ValueError("Corrupt image data")
+    keys = tables['canonical_keys'][symbols]
+    for i, value in raw_values.items():
+        keys[i] = value
+    return keys
+
+@Stage('decode')
+def decodeKeys(packed, bit_length, symbol_count, tables, group_bits=DECODE_GROUP_BITS, segment_bits=DECODE_SEGMENT_BITS, scalar_symbols=DECODE_SCALAR_SYMBOLS):
+    '''Decode symbol_count canonical codes from a packed bitstream into 24-bit pixel keys.
+
+    The stream is decoded group_bits bits at a time, so the temporary arrays stay bounded
+    however large the image is, and every group is split into segments of segment_bits bits
+    that are decoded in lockstep. Streams of at most scalar_symbols pixels go to
+    decodeKeysScalar instead.'''
+    if symbol_count <= scalar_symbols:
+        return decodeKeysScalar(packed, bit_length, symbol_count, tables)
+    padded = np.concatenate((packed, np.zeros(16, dtype=np.uint8)))
+    keys = np.empty(symbol_count, dtype=np.uint32)
+    decoded = 0
+    position = 0
+    for group_start in range(0, bit_length, group_bits):
+        group_end = min(group_start + group_bits, bit_length)
+        if position >= group_end:
+            continue
+        # Codes starting in the group, and the raw bits of escapes, end less than 64 bits past it.
+        first_bit = group_start & ~7
+        words = readWords(padded, first_bit >> 3, (group_end - first_bit) // 8 + 9)
+        starts, end = decodeCodeStarts(words, first_bit, position, group_end, tables, segment_bits)
+        lengths, symbols = getCodeLengthsAt(words, first_bit, starts, tables)
+        # The codes must form one unbroken chain from the previous group's last code.
+        if starts.size == 0 or starts[0] != position or np.any(lengths == 0) or np.any(starts[1:] != starts[:-1] + lengths[:-1]):
+            raise ValueError("Corrupt image data")
+        if decoded + starts.size > symbol_count:
+            raise ValueError("Image data holds more pixels than its header")
+
+        group_keys = tables['canonical_keys'][symbols]
+        escaped = np.flatnonzero(group_keys == ESCAPE_KEY)
+        if escaped.size:
+            raw_positions = starts[escaped] + tables['escape_length']
+            group_keys[escaped] = readBitWindows(words, first_bit, raw_positions, ESCAPE_RAW_BITS).astype(np.uint32)
+        keys[decoded:decoded + starts.size] = group_keys
+        decoded += starts.size
+        position = end
+
+    if decoded != symbol_count or position != bit_length:
+        raise ValueError("Corrupt image data")
+    return keys
+
+def encodeImage(image, huffman_code, tables=None, image_filter='none'):
+    '''Encode an (height, width, 3) uint8 image with a pixel model into a packed bitstream with a header.
+
+    The model should be trained on images passed through the same image_filter.'''
+    if image_filter not in IMAGE_FILTERS:
+        raise ValueError(f"Unknown image filter {image_filter!r}")
+    if tables is None:
+        tables = buildImageCodeTables(huffman_code)
+    image = np.asarray(image, dtype=np.uint8)
+    codes, lengths = lookupCodes(imageToKeys(applyFilter(image, image_filter)), tables)
+    packed, bit_length = packCodes(codes, lengths)
+    height, width = image.shape[:2]
+    return IMAGE_HEADER.pack(IMAGE_MAGIC, IMAGE_VERSION, IMAGE_FILTERS[image_filter], height, width, bit_length) + packed
+
+def decodeImage(data, huffman_code, tables=None):
+    '''Decode a bitstream written by encodeImage back into an (height, width, 3) uint8 image.'''
+    if len(data) < IMAGE_HEADER.size:
+        raise ValueError("Image data is too short")
+    magic, version, filter_id, height, width, bit_length = IMAGE_HEADER.unpack_from(data)
+    if magic != IMAGE_MAGIC:
+        raise ValueError("Not an encoded image")
+    if version != IMAGE_VERSION:
+        raise ValueError(f"Unsupported image format version {version}")
+    image_filter = next((name for name, value in IMAGE_FILTERS.items() if value == filter_id), None)
+    if image_filter is None:
+        raise ValueError(f"Unknown image filter id {filter_id}")
+    if height * width == 0:
+        return np.zeros((height, width, 3), dtype=np.uint8)
+    # Every pixel takes at least one bit, so a larger size is a corrupt header, not an allocation to make.
+    if height * width > bit_length:
+        raise ValueError(f"Image header claims {height}x{width} pixels in only {bit_length} bits")
+    packed = np.frombuffer(data, dtype=np.uint8, offset=IMAGE_HEADER.size)
+    if packed.size * 8 < bit_length:
+        raise ValueError("Image data is truncated")
+    if tables is None:
+        tables = buildImageCodeTables(huffman_code)
+    return invertFilter(keysToImage(decodeKeys(packed, bit_length, height * width, tables), height, width), image_filter)
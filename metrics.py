@@ -1,12 +1,66 @@
-'''This module measures time and space complexity of functions.'''
+'''This module measures time and space complexity of functions.
+
+Timings use time.perf_counter_ns. Besides the one-shot measure functions, named stages such as
+'frequency', 'tree_build', 'encode', 'pack' and 'decode' can be profiled in place: once
+enableStages() is called every run of a stage adds its duration to a histogram, and
+getStageReport() shows where the time went without re-running the workload.'''
+import time
+from functools import wraps
+
+# Stages instrumented in the Huffman codec.
+STAGE_NAMES = ('frequency', 'tree_build', 'encode', 'pack', 'decode')
+
+# Stage name -> histogram; filled only while stage profiling is enabled.
+_stages = {}
+_stages_enabled = False
+
+
+class Timer:
+    '''Context manager and decorator that measures elapsed time with perf_counter_ns.
+
+    with Timer() as timer:
+        ...
+    timer.duration is in seconds and timer.duration_ns in nanoseconds. With memory=True the
+    block also runs under tracemalloc and timer.current/timer.peak hold its traced memory, so
+    time and space come from the same run (tracing slows the timed code down).'''
+
+    def __init__(self, memory=False):
+        self.memory = memory
+        self.duration_ns = 0
+        self.current = 0
+        self.peak = 0
+
+    @property
+    def duration(self):
+        return self.duration_ns / 1e9
+
+    def __enter__(self):
+        if self.memory:
+            import tracemalloc
+            tracemalloc.start()
+        self._start = time.perf_counter_ns()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.duration_ns = time.perf_counter_ns() - self._start
+        if self.memory:
+            import tracemalloc
+            self.current, self.peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+        return False
+
+    def __call__(self, function):
+        @wraps(function)
+        def wrapper(*args, **kwargs):
+            with self:
+                return function(*args, **kwargs)
+        return wrapper
+
 def measureTime(function, *args):
     '''This function measures the time taken by a function to execute.'''
-    import time
-    start = time.time()
-    result = function(*args)
-    end = time.time()
-    duration = end - start
-    return result, duration
+    with Timer() as timer:
+        result = function(*args)
+    return result, timer.duration
 
 def measureSpace(function, *args):
     '''This function measures the space taken by a function to execute.'''
@@ -17,8 +71,114 @@ def measureSpace(function, *args):
     tracemalloc.stop()
     return result, current, peak
 
+def measure(function, *args, memory=False):
+    '''This function measures time and, with memory, traced memory of a single run.
+
+    Returns the result, the duration in seconds and the current and peak memory in bytes.'''
+    with Timer(memory) as timer:
+        result = function(*args)
+    return result, timer.duration, timer.current, timer.peak
+
 def getCompressionRatio(input_size, output_size):
     '''This function calculates the compression ratio.'''
     if input_size == 0:
         return 0
-    return (output_size / input_size)
\ No newline at end of file
+    return (output_size / input_size)
+
+def getThroughput(size_bytes, duration):
+    '''This function calculates the throughput in megabytes per second.'''
+    if duration <= 0:
+        return 0
+    return size_bytes / duration / 1e6
+
+def enableStages(enabled=True):
+    '''Turn stage profiling on or off. Disabled stages cost one flag check per call.'''
+    global _stages_enabled
+    _stages_enabled = enabled
+
+def resetStages():
+    '''Forget every recorded stage duration.'''
+    _stages.clear()
+
+def recordStage(name, duration_ns):
+    '''Add one duration to the histogram of a stage.
+
+    Durations are bucketed by powers of two: bucket b holds durations below 2**b nanoseconds.'''
+    histogram = _stages.get(name)
+    if histogram is None:
+        histogram = _stages[name] = {'count': 0, 'total_ns': 0, 'min_ns': duration_ns, 'max_ns': duration_ns, 'buckets': {}}
+    histogram['count'] += 1
+    histogram['total_ns'] += duration_ns
+    if duration_ns < histogram['min_ns']:
+        histogram['min_ns'] = duration_ns
+    if duration_ns > histogram['max_ns']:
+        histogram['max_ns'] = duration_ns
+    buckets = histogram['buckets']
+    bucket = duration_ns.bit_length()
+    buckets[bucket] = buckets.get(bucket, 0) + 1
+
+class Stage:
+    '''Context manager and decorator that records the run time of a named stage.
+
+    with Stage('encode'):
+        ...
+
+    @Stage('decode')
+    def decodeSomething(...): ...
+
+    Nothing is recorded while stage profiling is disabled.'''
+
+    def __init__(self, name):
+        self.name = name
+
+    def __enter__(self):
+        self._start = time.perf_counter_ns() if _stages_enabled else None
+        return self
+
+    def __exit__(self, *exc_info):
+        if self._start is not None:
+            recordStage(self.name, time.perf_counter_ns() - self._start)
+        return False
+
+    def __call__(self, function):
+        name = self.name
+
+        @wraps(function)
+        def wrapper(*args, **kwargs):
+            if not _stages_enabled:
+                return function(*args, **kwargs)
+            start = time.perf_counter_ns()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                recordStage(name, time.perf_counter_ns() - start)
+        return wrapper
+
+def getStagePercentile(histogram, percentile):
+    '''Estimate a percentile of a stage histogram as the upper bound of its bucket, in seconds.'''
+    rank = histogram['count'] * percentile / 100
+    seen = 0
+    for bucket in sorted(histogram['buckets']):
+        seen += histogram['buckets'][bucket]
+        if seen >= rank:
+            return min(1 << bucket, histogram['max_ns']) / 1e9
+    return histogram['max_ns'] / 1e9
+
+def getStageReport():
+    '''Summarize every recorded stage: call count, total/mean/min/max time, p50/p99 and the histogram.
+
+    Times are in seconds; the histogram maps the upper bound of each bucket in nanoseconds to its count.'''
+    report = {}
+    for name, histogram in _stages.items():
+        count = histogram['count']
+        report[name] = {
+            'count': count,
+            'total': histogram['total_ns'] / 1e9,
+            'mean': histogram['total_ns'] / count / 1e9,
+            'min': histogram['min_ns'] / 1e9,
+            'max': histogram['max_ns'] / 1e9,
+            'p50': getStagePercentile(histogram, 50),
+            'p99': getStagePercentile(histogram, 99),
+            'histogram': {1 << bucket: histogram['buckets'][bucket] for bucket in sorted(histogram['buckets'])},
+        }
+    return report
@@ -0,0 +1,108 @@
+'''This module keeps loaded Huffman models in memory so each model file is parsed only once per process.
+
+A model is loaded by path on first use and the most recently used models are kept in an LRU
+cache. Decode tables are only built when asked for: getDecodeTable fills in the table of the
+code in huffmancoding's decode table cache, the same table decode calls without an explicit
+table use, and pixel models build their image code tables on first request. Every process
+keeps its own parsed copy; model files are small, so the cost is one parse per process rather
+than per request. A model file that changes on disk is reloaded.'''
+import os
+import threading
+from collections import OrderedDict
+from huffmancoding import getCachedDecodeTable, fillDecodeTable, readCanonicalModelFromFile, readByteModelFromFile, readHuffmanCodeFromFile
+
+# Number of models kept before the least recently used one is evicted.
+DEFAULT_MAX_MODELS = 8
+
+# Model file formats: canonical binary model, 256-byte byte model and the legacy "char: code" text file.
+MODEL_CANONICAL = 'canonical'
+MODEL_BYTES = 'bytes'
+MODEL_LEGACY = 'legacy'
+
+_models = OrderedDict()
+_lock = threading.Lock()
+_max_models = DEFAULT_MAX_MODELS
+_statistics = {'hits': 0, 'misses': 0, 'evictions': 0}
+
+
+def readModelFile(filename, model_format=MODEL_CANONICAL):
+    '''Read a model file of the given format and return its code.'''
+    if model_format == MODEL_LEGACY:
+        return readHuffmanCodeFromFile(filename)
+    if model_format == MODEL_BYTES:
+        return readByteModelFromFile(filename)
+    return readCanonicalModelFromFile(filename)
+
+def loadModel(filename, model_format=MODEL_CANONICAL):
+    '''Get the cached entry of a model file, loading it on a miss.
+
+    The entry is a dict with the path, format, file version and code, and the image tables
+    once getImageTables has built them. Entries are shared, so callers must not modify them.'''
+    status = os.stat(filename)
+    key = (os.path.abspath(filename), model_format)
+    version = (status.st_mtime_ns, status.st_size)
+    with _lock:
+        entry = _models.get(key)
+        if entry is not None and entry['version'] == version:
+            _models.move_to_end(key)
+            _statistics['hits'] += 1
+            return entry
+
+    code = readModelFile(filename, model_format)
+    entry = {
+        'path': key[0],
+        'format': model_format,
+        'version': version,
+        'code': code,
+        'image_tables': None,
+    }
+    with _lock:
+        _statistics['misses'] += 1
+        _models[key] = entry
+        _models.move_to_end(key)
+        while len(_models) > _max_models:
+            _models.popitem(last=False)
+            _statistics['evictions'] += 1
+    return entry
+
+def getModel(filename, model_format=MODEL_CANONICAL):
+    '''Get the code of a model file from the cache.'''
+    return loadModel(filename, model_format)['code']
+
+def getDecodeTable(filename, model_format=MODEL_CANONICAL):
+    '''Get the shared decode table of a model file, with every transition of a dense table built.
+
+    The table lives in huffmancoding's decode table cache, so decode calls that do not pass a
+    table reuse it too.'''
+    return fillDecodeTable(getCachedDecodeTable(loadModel(filename, model_format)['code']))
+
+def getImageTables(filename):
+    '''Get the NumPy encode/decode tables of a pixel model file, built on first use.'''
+    entry = loadModel(filename)
+    if entry['image_tables'] is None:
+        from imagecoding import buildImageCodeTables
+        entry['image_tables'] = buildImageCodeTables(entry['code'])
+    return entry['image_tables']
+
+def setMaxModels(max_models):
+    '''Change how many models the cache keeps, evicting the least recently used ones if needed.'''
+    global _max_models
+    if max_models < 1:
+        raise ValueError("The model cache must hold at least one model")
+    with _lock:
+        _max_models = max_models
+        while len(_models) > _max_models:
+            _models.popitem(last=False)
+            _statistics['evictions'] += 1
+
+def clearModelCache():
+    '''Drop every cached model and reset the statistics.'''
+    with _lock:
+        _models.clear()
+        for name in _statistics:
+            _statistics[name] = 0
+
+def getModelCacheInfo():
+    '''Get the hit, miss and eviction counts and the paths of the cached models, most recent last.'''
+    with _lock:
+        return dict(_statistics, size=len(_models), max_models=_max_models, models=[path for path, _ in _models])
@@ -0,0 +1,126 @@
+'''This module splits input into independently decodable blocks and encodes or decodes them across processes.'''
+import struct
+import zlib
+from concurrent.futures import ProcessPoolExecutor
+from huffmancoding import encode, packBits, buildDecodeTable, decodePackedSymbols, decodePackedText
+
+# Block container: magic, format version and number of blocks, followed by the block index
+# and a CRC32 of the header and index.
+BLOCK_MAGIC = b'HUFB'
+BLOCK_VERSION = 2
+BLOCK_HEADER = struct.Struct('>4sBI')
+# One index entry per block: offset of its packed bits, bit length, number of symbols and CRC32.
+BLOCK_INDEX_ENTRY = struct.Struct('>QQII')
+BLOCK_INDEX_CRC = struct.Struct('>I')
+
+# Number of symbols per block.
+DEFAULT_BLOCK_SIZE = 1 << 18
+
+# Model shared by the worker processes, set once per process by initWorker.
+_worker_huffman_code = None
+_worker_decode_table = None
+
+
+def initWorker(huffman_code):
+    '''Store the Huffman code in the worker process so it is not sent with every block.'''
+    global _worker_huffman_code, _worker_decode_table
+    _worker_huffman_code = huffman_code
+    _worker_decode_table = buildDecodeTable(huffman_code)
+
+def encodeBlock(block):
+    '''Encode one block with the worker model, return its bit length and packed bits.'''
+    encoded_text = encode(block, _worker_huffman_code)
+    return len(encoded_text), packBits(encoded_text)
+
+def decodeBlock(packed_block):
+    '''Decode one (packed bits, bit length, separator) block with the worker model into a string.
+
+    The symbols are joined in the worker, so one string per block is sent back instead of a
+    list with an object per symbol.'''
+    packed, bit_length, separator = packed_block
+    return decodePackedText(packed, bit_length, _worker_decode_table, separator)
+
+def decodeByteBlock(packed_block):
+    '''Decode one (packed bits, bit length) block with the worker byte code table into bytes.'''
+    packed, bit_length = packed_block
+    return bytes(decodePackedSymbols(packed, bit_length, _worker_decode_table))
+
+def splitBlocks(text, block_size=DEFAULT_BLOCK_SIZE):
+    '''Split the text (or list of symbols) into blocks of at most block_size symbols.'''
+    return [text[i:i + block_size] for i in range(0, len(text), block_size)]
+
+def runBlocks(function, items, huffman_code, max_workers=None):
+    '''Apply a worker function to every item, in a process pool when there is more than one item.'''
+    if max_workers == 1 or len(items) <= 1:
+        initWorker(huffman_code)
+        return [function(item) for item in items]
+    with ProcessPoolExecutor(max_workers=max_workers, initializer=initWorker, initargs=(huffman_code,)) as executor:
+        return list(executor.map(function, items))
+
+def packBlocks(encoded_blocks, symbol_counts):
+    '''Write the container header, block index and packed blocks.'''
+    index = bytearray(BLOCK_HEADER.pack(BLOCK_MAGIC, BLOCK_VERSION, len(encoded_blocks)))
+    offset = 0
+    for (bit_length, packed), symbol_count in zip(encoded_blocks, symbol_counts):
+        index += BLOCK_INDEX_ENTRY.pack(offset, bit_length, symbol_count, zlib.crc32(packed))
+        offset += len(packed)
+    index += BLOCK_INDEX_CRC.pack(zlib.crc32(index))
+    return bytes(index) + b''.join(packed for _, packed in encoded_blocks)
+
+def readBlockIndex(data):
+    '''Read and verify the block index of a container, return a list of (start, end, bit length, symbol count, CRC32).
+
+    The CRC32 of each block is checked by readBlock, so reading one block does not read the others.'''
+    if len(data) < BLOCK_HEADER.size:
+        raise ValueError("Block container is too short")
+    magic, version, block_count = BLOCK_HEADER.unpack_from(data)
+    if magic != BLOCK_MAGIC:
+        raise ValueError("Not a block container")
+    if version != BLOCK_VERSION:
+        raise ValueError(f"Unsupported block container version {version}")
+
+    index_end = BLOCK_HEADER.size + block_count * BLOCK_INDEX_ENTRY.size
+    data_start = index_end + BLOCK_INDEX_CRC.size
+    if len(data) < data_start:
+        raise ValueError("Block index is truncated")
+    if zlib.crc32(data[:index_end]) != BLOCK_INDEX_CRC.unpack_from(data, index_end)[0]:
+        raise ValueError("Block index failed its CRC32 check")
+    blocks = []
+    for i in range(block_count):
+        offset, bit_length, symbol_count, crc = BLOCK_INDEX_ENTRY.unpack_from(data, BLOCK_HEADER.size + i * BLOCK_INDEX_ENTRY.size)
+        start = data_start + offset
+        end = start + (bit_length + 7) // 8
+        if end > len(data):
+            raise ValueError(f"Block {i} is truncated")
+        blocks.append((start, end, bit_length, symbol_count, crc))
+    return blocks
+
+def readBlock(data, blocks, block_number):
+    '''Get the packed bits of a block listed by readBlockIndex, verifying its CRC32.'''
+    start, end, _, _, crc = blocks[block_number]
+    packed = bytes(data[start:end])
+    if zlib.crc32(packed) != crc:
+        raise ValueError(f"Block {block_number} failed its CRC32 check")
+    return packed
+
+def compressBlocks(text, huffman_code, block_size=DEFAULT_BLOCK_SIZE, max_workers=None):
+    '''Compress the text into a block container, encoding blocks in parallel.
+
+    The model is typically the trained one from training.getHuffmanCodeTextModel.'''
+    blocks = splitBlocks(text, block_size)
+    encoded_blocks = runBlocks(encodeBlock, blocks, huffman_code, max_workers)
+    return packBlocks(encoded_blocks, [len(block) for block in blocks])
+
+def decompressBlocks(data, huffman_code, separator='', max_workers=None):
+    '''Decompress a whole block container, decoding blocks in parallel.'''
+    blocks = readBlockIndex(data)
+    packed_blocks = [(readBlock(data, blocks, i), bit_length, separator) for i, (_, _, bit_length, _, _) in enumerate(blocks)]
+    return separator.join(runBlocks(decodeBlock, packed_blocks, huffman_code, max_workers))
+
+def decompressBlockAt(data, huffman_code, block_number, separator='', decode_table=None):
+    '''Decompress a single block of the container without decoding the others.'''
+    blocks = readBlockIndex(data)
+    packed = readBlock(data, blocks, block_number)
+    if decode_table is None:
+        decode_table = buildDecodeTable(huffman_code)
+    return decodePackedText(packed, blocks[block_number][2], decode_table, separator)
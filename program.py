@@ -1,14 +1,153 @@
-'''This module is the main program that uses Huffman coding to compress text and images.'''
-import base64
-import io
-from huffmancoding import huffmanCoding, encode, decode
-from metrics import measureTime, measureSpace, getCompressionRatio
-from training import getHuffmanCodeTextModel, getHuffmanCodeImageModel, getImageTrainingData, trainHuffmanCodeImage, trainHuffmanCodeText, convertToBase64, convertToImage, trainHuffmanCodeImageHash
+'''This module is the main program that uses Huffman coding to compress text and images.
+
+Run without arguments for the interactive menu, or script it with subcommands:
+
+    python program.py compress notes.txt -o notes.huf
+    python program.py decompress notes.huf -o notes.txt
+    cat notes.txt | python program.py compress --model trained > notes.huf
+    python program.py compress photo.png --image -o photo.huf
+    python program.py decompress photo.huf -o photo.png
+    python program.py train text
+
+Byte containers embed their model by default. Image containers store only the model id by
+default, because the pixel model is far larger than a typical image; pass --embed to include it.
+
+NumPy, PIL and the training datasets are only imported by the commands that use them.'''
+import argparse
 import os
-import numpy as np
-from PIL import Image
-from charset_normalizer import detect
-if __name__ == "__main__":
+import sys
+from huffmancoding import encodeBytes, decodeBytes
+from metrics import getCompressionRatio
+from modelcache import getDecodeTable, getImageTables, MODEL_BYTES
+from training import BYTE_MODEL_FILE, getImageModelFile, getHuffmanCodeByteModel, getHuffmanCodeImageModel, trainHuffmanCodeImage, trainHuffmanCodeText, trainHuffmanCodeBytes, trainHuffmanCodeWords
+
+# Prediction filter applied to images before Huffman coding, see imagecoding.IMAGE_FILTERS
+IMAGE_FILTER = 'paeth'
+
+# Models the train subcommand can build.
+TRAINERS = {
+    'text': trainHuffmanCodeText,
+    'bytes': trainHuffmanCodeBytes,
+    'words': trainHuffmanCodeWords,
+    'image': lambda: trainHuffmanCodeImage(image_filter=IMAGE_FILTER),
+}
+
+
+def readInput(path):
+    '''Read the bytes of a file, or of stdin when path is '-'.'''
+    if path == '-':
+        return sys.stdin.buffer.read()
+    with open(path, 'rb') as file:
+        return file.read()
+
+def writeOutput(path, data):
+    '''Write bytes to a file, or to stdout when path is '-'.'''
+    if path == '-':
+        sys.stdout.buffer.write(data)
+        sys.stdout.buffer.flush()
+        return
+    with open(path, 'wb') as file:
+        file.write(data)
+
+def readImage(data):
+    '''Decode image file bytes into an RGB uint8 array.'''
+    import io
+    import numpy as np
+    from PIL import Image
+    return np.asarray(Image.open(io.BytesIO(data)).convert("RGB"))
+
+def writeImage(image):
+    '''Encode an RGB uint8 array as PNG file bytes.'''
+    import io
+    from PIL import Image
+    buffer = io.BytesIO()
+    Image.fromarray(image).save(buffer, format="PNG")
+    return buffer.getvalue()
+
+def compressCommand(arguments):
+    '''Compress a file or stdin into a container.'''
+    from container import compressBytes, compressImage
+    data = readInput(arguments.input)
+    if arguments.image:
+        image = readImage(data)
+        embed_model = bool(arguments.embed)
+        payload = compressImage(image, getHuffmanCodeImageModel(IMAGE_FILTER), IMAGE_FILTER, embed_model)
+        original_size = image.nbytes
+    else:
+        byte_code = getHuffmanCodeByteModel() if arguments.model == 'trained' else None
+        embed_model = arguments.embed is not False
+        payload = compressBytes(data, byte_code, embed_model, max_workers=arguments.workers)
+        original_size = len(data)
+    writeOutput(arguments.output, payload)
+    print("Compression ratio: ", getCompressionRatio(original_size, len(payload)), file=sys.stderr)
+
+def decompressCommand(arguments):
+    '''Decompress a container from a file or stdin. Images are written as PNG.'''
+    from container import readContainer, decompressBytes, decompressImage, KIND_IMAGE, MODEL_EMBEDDED
+    payload = readInput(arguments.input)
+    container = readContainer(payload)
+    embedded = container['model_type'] == MODEL_EMBEDDED
+    if container['kind'] == KIND_IMAGE:
+        image = decompressImage(payload, None if embedded else getHuffmanCodeImageModel(IMAGE_FILTER))
+        writeOutput(arguments.output, writeImage(image))
+    else:
+        byte_code = None if embedded else getHuffmanCodeByteModel()
+        writeOutput(arguments.output, decompressBytes(payload, byte_code, max_workers=arguments.workers))
+
+def trainCommand(arguments):
+    '''Train the selected models and save them under the model directory.'''
+    for model in arguments.models:
+        print("Training the", model, "model...", file=sys.stderr)
+        TRAINERS[model]()
+    print("Training complete!", file=sys.stderr)
+
+def getArgumentParser():
+    '''Build the parser of the non-interactive command line.'''
+    parser = argparse.ArgumentParser(description="Compress and decompress data with Huffman coding.")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    compress_parser = subparsers.add_parser('compress', help="compress a file or stdin into a container")
+    compress_parser.add_argument('input', nargs='?', default='-', help="input file, '-' for stdin")
+    compress_parser.add_argument('-o', '--output', default='-', help="output file, '-' for stdout")
+    compress_parser.add_argument('--model', choices=('input', 'trained'), default='input',
+                                 help="byte model trained on the input itself or the saved trained model")
+    compress_parser.add_argument('--image', action='store_true', help="the input is an image file, coded with the saved image model")
+    compress_parser.add_argument('--embed', dest='embed', action='store_true', default=None,
+                                 help="embed the model in the container, the default for bytes")
+    compress_parser.add_argument('--no-embed', dest='embed', action='store_false',
+                                 help="store only the model id, the trained model is needed to decompress; the default for images")
+    compress_parser.add_argument('--workers', type=int, default=None, help="processes used to encode blocks")
+    compress_parser.set_defaults(function=compressCommand)
+
+    decompress_parser = subparsers.add_parser('decompress', help="decompress a container from a file or stdin")
+    decompress_parser.add_argument('input', nargs='?', default='-', help="input file, '-' for stdin")
+    decompress_parser.add_argument('-o', '--output', default='-', help="output file, '-' for stdout")
+    decompress_parser.add_argument('--workers', type=int, default=None, help="processes used to decode blocks")
+    decompress_parser.set_defaults(function=decompressCommand)
+
+    train_parser = subparsers.add_parser('train', help="train and save models")
+    train_parser.add_argument('models', nargs='+', choices=sorted(TRAINERS))
+    train_parser.set_defaults(function=trainCommand)
+    return parser
+
+def main(argv=None):
+    '''Run a subcommand, or the interactive menu when no arguments are given.'''
+    argv = sys.argv[1:] if argv is None else argv
+    if not argv:
+        runInteractive()
+        return
+    arguments = getArgumentParser().parse_args(argv)
+    try:
+        arguments.function(arguments)
+    except FileNotFoundError as error:
+        sys.exit(f"File not found: {error.filename}")
+    except ValueError as error:
+        sys.exit(f"Error: {error}")
+    except OSError as error:
+        # Includes PIL.UnidentifiedImageError for --image inputs that are not images.
+        sys.exit(f"Error: {error}")
+
+def runInteractive():
     '''This function will ask the user for what they want to do. 1 - Train the Huffman coding model, 2 - Train the Huffman coding model with images, 3 - Compress text, 4 - Compress an image'''
     print("Welcome to the Huffman coding program!")
     print("1 - Train the Huffman coding model for text compression")
@@ -16,55 +155,53 @@ if __name__ == "__main__":
     print("3 - Compress some text")
     print("4 - Compress an image")
     print("Q - Quit")
-    
+
     choice = input("Enter your choice: ")
     while choice != 'Q':
         if choice == '1':
             print("Training the Huffman coding model for text compression...")
             trainHuffmanCodeText()
+            trainHuffmanCodeBytes()
             print("Training complete!")
         elif choice == '2':
             print("Training the Huffman coding model for image compression...")
             #trainHuffmanCodeImageHash()
-            trainHuffmanCodeImage()
+            trainHuffmanCodeImage(image_filter=IMAGE_FILTER)
             print("Training complete!")
         elif choice == '3':
             print("Compressing some text...")
             text_to_compress = input("Enter the text to compress: ")
 
-            huffman_code_text = getHuffmanCodeTextModel()
-            encoded_text = encode(text_to_compress, huffman_code_text)
-            print("Encoded text: ", encoded_text[:100])
-            print("Original text length(bits): ", len(text_to_compress)*8)
-            print("Encoded text length(bits): ", len(encoded_text))
-            print("Compression ratio: ", getCompressionRatio(len(text_to_compress)*8, len(encoded_text)), "%")
+            # The byte-level model has a code for every byte, so any input can be encoded
+            byte_code = getHuffmanCodeByteModel()
+            text_bytes = text_to_compress.encode("utf-8")
+            encoded_text = encodeBytes(text_bytes, byte_code)
+            original_size = len(text_bytes)
+            print("Encoded text: ", encoded_text[:100].hex())
+            print("Original text size(bytes): ", original_size)
+            print("Encoded text size(bytes): ", len(encoded_text))
+            print("Compression ratio: ", getCompressionRatio(original_size, len(encoded_text)), "%")
+            print("Round trip OK: ", decodeBytes(encoded_text, byte_code, getDecodeTable(BYTE_MODEL_FILE, MODEL_BYTES)) == text_bytes)
         elif choice == '4':
             '''User enter a path of an image to compress'''
             image_path = input("Enter the path of the image to compress: ")
             if os.path.exists(image_path):
-                # Open the image file
-                image = Image.open(image_path)
-                dimensions = image.size
-                base64Image = convertToBase64(image)
-                huffman_code_image = getHuffmanCodeImageModel()
-                encoded_image = encode(base64Image, huffman_code_image)
-                print ("Original image size(bits): ", os.path.getsize(image_path)*8)
-                print("Encoded image: ", encoded_image[:100])
-                print("Original image length(bits): ", len(base64Image)*8)
-                print("Encoded image length(bits): ", len(encoded_image))
-                print("Compression ratio: ", getCompressionRatio(len(base64Image)*8, len(encoded_image)), "%")
-                decoded_image = decode(encoded_image, huffman_code_image)
-                print("Decoded image: ", decoded_image[:100])
-                # Convert base64 encoded decoded_image to Image object
-                numpy_data = base64.b64decode(decoded_image)
-                image_data = np.frombuffer(numpy_data, dtype=np.uint8)
-                image_data = image_data.reshape(dimensions[1], dimensions[0], 3)
-                decoded_image = Image.fromarray(image_data)
-                decoded_image.save("decoded_image.png", format="PNG")
+                from imagecoding import encodeImage, decodeImage
+                # Open the image file as an RGB array
+                with open(image_path, 'rb') as file:
+                    image_data = readImage(file.read())
+                huffman_code_image = getHuffmanCodeImageModel(IMAGE_FILTER)
+                image_tables = getImageTables(getImageModelFile(IMAGE_FILTER))
+                encoded_image = encodeImage(image_data, huffman_code_image, image_tables, IMAGE_FILTER)
+                print("Original image size(bits): ", os.path.getsize(image_path)*8)
+                print("Encoded image: ", encoded_image[:100].hex())
+                print("Original image length(bytes): ", image_data.nbytes)
+                print("Encoded image length(bytes): ", len(encoded_image))
+                print("Compression ratio: ", getCompressionRatio(image_data.nbytes, len(encoded_image)), "%")
+                decoded_image = decodeImage(encoded_image, huffman_code_image, image_tables)
+                with open("decoded_image.png", 'wb') as file:
+                    file.write(writeImage(decoded_image))
                 print("Decoded image saved as decoded_image.png")
-
-
-
             else:
                 print("File not found!")
         elif choice == 'Q':
@@ -72,5 +209,5 @@ if __name__ == "__main__":
             break
         choice = input("Enter your choice: ")
 
-
-
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,331 @@
+'''This module serves compression over a local TCP or Unix socket with asyncio.
+
+Requests and responses are length-prefixed frames: a SERVICE_HEADER with the operation (or
+response status), a request id and the payload length, followed by the payload. A connection
+may pipeline several requests; responses carry the id of their request and can arrive out of
+order. Data is coded with the trained byte model, which every worker process loads once through
+the model cache. Small requests are batched into one pool task, and at most max_pending
+requests are in flight at a time, after which the server stops reading from its clients. Idle
+connections hold no slot.
+
+    python service.py serve --port 8765
+    python service.py load --port 8765 --connections 16 --requests 2000 --size 4096
+'''
+import argparse
+import asyncio
+import statistics
+import struct
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from huffmancoding import encodeBytes, decodeBytes
+from metrics import getThroughput
+from modelcache import getModel, getDecodeTable, MODEL_BYTES
+
+# Frame header: operation or status, request id and payload length.
+SERVICE_HEADER = struct.Struct('>BII')
+OP_COMPRESS = 1
+OP_DECOMPRESS = 2
+STATUS_OK = 0
+STATUS_ERROR = 1
+
+DEFAULT_HOST = '127.0.0.1'
+DEFAULT_PORT = 8765
+# Largest accepted request payload.
+MAX_REQUEST_SIZE = 1 << 26
+# Requests below this many bytes are batched, larger ones get a pool task of their own.
+DEFAULT_BATCH_THRESHOLD = 1 << 16
+DEFAULT_MAX_BATCH_SIZE = 64
+# Seconds to wait for more small requests before an incomplete batch is sent.
+DEFAULT_BATCH_DELAY = 0.001
+# Requests in flight before the server stops reading from its clients.
+DEFAULT_MAX_PENDING = 256
+
+# Byte model of the worker process, set once per process by initServiceWorker.
+_worker_model = None
+
+
+def initServiceWorker(model_path):
+    '''Load the byte model and its decode table into the worker process.'''
+    global _worker_model
+    _worker_model = {'code': getModel(model_path, MODEL_BYTES), 'decode_table': getDecodeTable(model_path, MODEL_BYTES)}
+
+def processRequest(operation, data):
+    '''Compress or decompress one payload with the worker model, return (status, payload).'''
+    try:
+        if operation == OP_COMPRESS:
+            return STATUS_OK, encodeBytes(data, _worker_model['code'])
+        if operation == OP_DECOMPRESS:
+            return STATUS_OK, decodeBytes(data, _worker_model['code'], _worker_model['decode_table'])
+        raise ValueError(f"Unknown operation {operation}")
+    except ValueError as error:
+        return STATUS_ERROR, str(error).encode('utf-8')
+
+def processBatch(requests):
+    '''Process a list of (operation, payload) requests in one pool task.'''
+    return [processRequest(operation, data) for operation, data in requests]
+
+def packFrame(code, request_id, payload):
+    '''Build a frame from an operation or status, a request id and a payload.'''
+    return SERVICE_HEADER.pack(code, request_id, len(payload)) + payload
+
+async def readFrame(reader):
+    '''Read one frame, return (code, request id, payload) or None at the end of the stream.'''
+    try:
+        header = await reader.readexactly(SERVICE_HEADER.size)
+    except asyncio.IncompleteReadError as error:
+        if error.partial:
+            raise ValueError("Connection closed inside a frame header")
+        return None
+    code, request_id, length = SERVICE_HEADER.unpack(header)
+    if length > MAX_REQUEST_SIZE:
+        raise ValueError(f"Frame of {length} bytes exceeds the {MAX_REQUEST_SIZE} byte limit")
+    return code, request_id, await reader.readexactly(length)
+
+
+class CompressionService:
+    '''Asyncio compression server that batches small requests onto a process pool.
+
+    max_workers=0 runs the codec on the event loop's default thread pool instead of
+    worker processes, which is only useful for tests and debugging.'''
+
+    def __init__(self, model_path, max_workers=None, max_pending=DEFAULT_MAX_PENDING, batch_threshold=DEFAULT_BATCH_THRESHOLD,
+                 max_batch_size=DEFAULT_MAX_BATCH_SIZE, batch_delay=DEFAULT_BATCH_DELAY):
+        self.model_path = model_path
+        self.max_workers = max_workers
+        self.max_pending = max_pending
+        self.batch_threshold = batch_threshold
+        self.max_batch_size = max_batch_size
+        self.batch_delay = batch_delay
+        self.executor = None
+        self.server = None
+        self.statistics = {'requests': 0, 'batches': 0, 'errors': 0}
+        # Running batch tasks, referenced so they are not garbage collected.
+        self.tasks = set()
+        # Open client connections and the tasks serving them.
+        self.connections = {}
+
+    async def start(self, host=DEFAULT_HOST, port=DEFAULT_PORT, path=None):
+        '''Load the model, start the pool and listen on a TCP port, or on a Unix socket path.'''
+        # Fail before listening if the model is missing or invalid.
+        initServiceWorker(self.model_path)
+        if self.max_workers != 0:
+            self.executor = ProcessPoolExecutor(self.max_workers, initializer=initServiceWorker, initargs=(self.model_path,))
+        self.pending = asyncio.Semaphore(self.max_pending)
+        self.queue = asyncio.Queue()
+        self.batcher = asyncio.create_task(self.runBatcher())
+        if path is not None:
+            self.server = await asyncio.start_unix_server(self.handleConnection, path)
+        else:
+            self.server = await asyncio.start_server(self.handleConnection, host, port)
+        return self.server
+
+    async def close(self):
+        '''Stop listening, finish the requests in flight, then stop the batcher and the pool.'''
+        if self.server is not None:
+            self.server.close()
+            await self.server.wait_closed()
+        # Closing the connections ends their read loops once their pending requests are answered.
+        for writer in list(self.connections.values()):
+            writer.close()
+        await asyncio.gather(*self.connections, return_exceptions=True)
+        self.batcher.cancel()
+        if self.executor is not None:
+            self.executor.shutdown(cancel_futures=True)
+
+    def getAddress(self):
+        '''Get the TCP (host, port) or Unix socket path the server listens on.'''
+        return self.server.sockets[0].getsockname()
+
+    async def runBatch(self, batch):
+        '''Run a batch of (operation, payload, future) requests in the pool and resolve their futures.'''
+        self.statistics['batches'] += 1
+        try:
+            results = await asyncio.get_running_loop().run_in_executor(self.executor, processBatch, [(operation, data) for operation, data, _ in batch])
+        except Exception as error:
+            results = [(STATUS_ERROR, f"Worker failed: {error}".encode('utf-8'))] * len(batch)
+        for (_, _, future), result in zip(batch, results):
+            if not future.done():
+                future.set_result(result)
+
+    def startBatch(self, batch):
+        '''Start a batch task without waiting for it.'''
+        task = asyncio.create_task(self.runBatch(batch))
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+
+    async def runBatcher(self):
+        '''Collect small requests from the queue into batches and start them.'''
+        while True:
+            batch = [await self.queue.get()]
+            while len(batch) < self.max_batch_size:
+                if self.queue.empty():
+                    if self.batch_delay <= 0 or len(batch) > 1:
+                        break
+                    # A lone request waits briefly for company before going out on its own.
+                    await asyncio.sleep(self.batch_delay)
+                    if self.queue.empty():
+                        break
+                batch.append(self.queue.get_nowait())
+            self.startBatch(batch)
+
+    async def submit(self, operation, data):
+        '''Process one request and return (status, payload).'''
+        future = asyncio.get_running_loop().create_future()
+        if len(data) < self.batch_threshold:
+            self.queue.put_nowait((operation, data, future))
+        else:
+            self.startBatch([(operation, data, future)])
+        return await future
+
+    async def handleRequest(self, operation, request_id, data, writer):
+        '''Answer one request and release its slot.'''
+        try:
+            status, payload = await self.submit(operation, data)
+            self.statistics['requests'] += 1
+            if status != STATUS_OK:
+                self.statistics['errors'] += 1
+            writer.write(packFrame(status, request_id, payload))
+            await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            self.pending.release()
+
+    async def handleConnection(self, reader, writer):
+        '''Read pipelined requests from one client until it disconnects.'''
+        tasks = set()
+        connection = asyncio.current_task()
+        self.connections[connection] = writer
+        try:
+            while True:
+                try:
+                    frame = await readFrame(reader)
+                except (ValueError, ConnectionError) as error:
+                    writer.write(packFrame(STATUS_ERROR, 0, str(error).encode('utf-8')))
+                    break
+                if frame is None:
+                    break
+                # Take a slot only once a request has arrived, so idle connections hold none. The
+                # next frame is not read until a slot is free, so a saturated server still pushes
+                # back on its clients.
+                await self.pending.acquire()
+                task = asyncio.create_task(self.handleRequest(*frame, writer))
+                tasks.add(task)
+                task.add_done_callback(tasks.discard)
+            if tasks:
+                await asyncio.gather(*tasks)
+        finally:
+            del self.connections[connection]
+            writer.close()
+            try:
+                await writer.wait_closed()
+            except ConnectionError:
+                pass
+
+async def openConnection(host=DEFAULT_HOST, port=DEFAULT_PORT, path=None):
+    '''Connect to a service over TCP, or over a Unix socket when path is given.'''
+    if path is not None:
+        return await asyncio.open_unix_connection(path)
+    return await asyncio.open_connection(host, port)
+
+async def sendRequest(reader, writer, operation, data, request_id=0):
+    '''Send one request and wait for its response payload. Raise ValueError if the service reports an error.'''
+    writer.write(packFrame(operation, request_id, data))
+    await writer.drain()
+    frame = await readFrame(reader)
+    if frame is None:
+        raise ConnectionError("The service closed the connection")
+    status, _, payload = frame
+    if status != STATUS_OK:
+        raise ValueError(payload.decode('utf-8', 'replace'))
+    return payload
+
+async def runLoad(host=DEFAULT_HOST, port=DEFAULT_PORT, path=None, connections=16, requests=2000, size=4096, operation=OP_COMPRESS, seed=0):
+    '''Send requests of size bytes over several connections, one in flight per connection.
+
+    Returns the request count, duration, throughput in requests per second and MB/s of
+    request payload, and the mean, p50 and p99 latency in seconds.'''
+    from benchmark import getSyntheticText
+    text = ''.join(getSyntheticText(size * 8, seed)).encode('utf-8')
+    samples = [text[i * size // 2:i * size // 2 + size] for i in range(8)]
+    streams = [await openConnection(host, port, path) for _ in range(connections)]
+    if operation == OP_DECOMPRESS:
+        samples = [await sendRequest(*streams[0], OP_COMPRESS, sample) for sample in samples]
+
+    latencies = []
+    counter = iter(range(requests))
+
+    async def worker(reader, writer):
+        for request_id in counter:
+            start = time.perf_counter_ns()
+            await sendRequest(reader, writer, operation, samples[request_id % len(samples)], request_id)
+            latencies.append((time.perf_counter_ns() - start) / 1e9)
+
+    start = time.perf_counter_ns()
+    try:
+        await asyncio.gather(*(worker(reader, writer) for reader, writer in streams))
+    finally:
+        duration = (time.perf_counter_ns() - start) / 1e9
+        for _, writer in streams:
+            writer.close()
+        await asyncio.gather(*(writer.wait_closed() for _, writer in streams), return_exceptions=True)
+    if len(latencies) > 1:
+        percentiles = statistics.quantiles(latencies, n=100, method='inclusive')
+    else:
+        percentiles = (latencies or [0.0]) * 99
+    return {
+        'requests': len(latencies),
+        'duration': duration,
+        'requests_per_second': len(latencies) / duration if duration > 0 else 0,
+        'throughput_mb_s': getThroughput(sum(len(samples[i % len(samples)]) for i in range(len(latencies))), duration),
+        'mean': statistics.mean(latencies) if latencies else 0.0,
+        'p50': percentiles[49],
+        'p99': percentiles[98],
+    }
+
+async def serve(arguments):
+    '''Run the service until interrupted.'''
+    service = CompressionService(arguments.model, arguments.workers, arguments.max_pending, batch_delay=arguments.batch_delay)
+    await service.start(arguments.host, arguments.port, arguments.unix)
+    print("Serving on", service.getAddress(), file=sys.stderr)
+    try:
+        await service.server.serve_forever()
+    finally:
+        await service.close()
+
+def main(argv=None):
+    '''Run the serve or load subcommand.'''
+    from training import BYTE_MODEL_FILE
+    parser = argparse.ArgumentParser(description="Local Huffman compression service and load generator.")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    for name in ('serve', 'load'):
+        subparser = subparsers.add_parser(name)
+        subparser.add_argument('--host', default=DEFAULT_HOST)
+        subparser.add_argument('--port', type=int, default=DEFAULT_PORT)
+        subparser.add_argument('--unix', default=None, help="Unix socket path to use instead of TCP")
+    serve_parser = subparsers.choices['serve']
+    serve_parser.add_argument('--model', default=BYTE_MODEL_FILE, help="byte model file")
+    serve_parser.add_argument('--workers', type=int, default=None, help="worker processes, 0 to run in threads")
+    serve_parser.add_argument('--max-pending', type=int, default=DEFAULT_MAX_PENDING)
+    serve_parser.add_argument('--batch-delay', type=float, default=DEFAULT_BATCH_DELAY)
+    load_parser = subparsers.choices['load']
+    load_parser.add_argument('--connections', type=int, default=16)
+    load_parser.add_argument('--requests', type=int, default=2000)
+    load_parser.add_argument('--size', type=int, default=4096, help="bytes of text per request")
+    load_parser.add_argument('--operation', choices=('compress', 'decompress'), default='compress')
+    arguments = parser.parse_args(argv)
+
+    if arguments.command == 'serve':
+        try:
+            asyncio.run(serve(arguments))
+        except KeyboardInterrupt:
+            pass
+        return
+    operation = OP_COMPRESS if arguments.operation == 'compress' else OP_DECOMPRESS
+    result = asyncio.run(runLoad(arguments.host, arguments.port, arguments.unix, arguments.connections, arguments.requests, arguments.size, operation))
+    print(f"{result['requests']} requests in {result['duration']:.3f} s: {result['requests_per_second']:.1f} req/s, {result['throughput_mb_s']:.2f} MB/s")
+    print(f"latency mean {result['mean'] * 1000:.3f} ms  p50 {result['p50'] * 1000:.3f} ms  p99 {result['p99'] * 1000:.3f} ms")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,86 @@
+'''This module compresses and decompresses files in fixed-size chunks so memory use stays bounded.'''
+import os
+from huffmancoding import BIT_LENGTH_HEADER, encodeToBytes, getCachedDecodeTable, decodePackedText
+from metrics import measure, getThroughput
+
+# Number of characters encoded per frame.
+DEFAULT_CHUNK_SIZE = 1 << 16
+
+
+def readChunks(reader, chunk_size=DEFAULT_CHUNK_SIZE):
+    '''Yield successive chunks from a file-like reader until it is exhausted.'''
+    while True:
+        chunk = reader.read(chunk_size)
+        if not chunk:
+            return
+        yield chunk
+
+def encodeChunks(chunks, huffman_code):
+    '''Encode each chunk into an independent frame: a bit length header followed by the packed bits.'''
+    for chunk in chunks:
+        yield encodeToBytes(chunk, huffman_code)
+
+def decodeFrames(reader, huffman_code, separator='', decode_table=None):
+    '''Read frames from a binary reader and yield the decoded chunk of each one.
+
+    The separator goes between symbols, including between the last symbol of a frame and the
+    first of the next, so the chunks join into the same text as decoding in one piece.'''
+    if decode_table is None:
+        decode_table = getCachedDecodeTable(huffman_code)
+    leading = ''
+    while True:
+        header = reader.read(BIT_LENGTH_HEADER.size)
+        if not header:
+            return
+        if len(header) < BIT_LENGTH_HEADER.size:
+            raise ValueError("Truncated frame header")
+        (bit_length,) = BIT_LENGTH_HEADER.unpack(header)
+        packed = reader.read((bit_length + 7) // 8)
+        if len(packed) * 8 < bit_length:
+            raise ValueError("Truncated frame")
+        yield leading + decodePackedText(packed, bit_length, decode_table, separator)
+        leading = separator
+
+def encodeStream(reader, writer, huffman_code, chunk_size=DEFAULT_CHUNK_SIZE):
+    '''Encode everything from reader into frames written to a binary writer. Return the number of bytes written.'''
+    written = 0
+    for frame in encodeChunks(readChunks(reader, chunk_size), huffman_code):
+        writer.write(frame)
+        written += len(frame)
+    return written
+
+def decodeStream(reader, writer, huffman_code, separator='', decode_table=None):
+    '''Decode frames from a binary reader and write the chunks to writer. Return the number of symbols written.'''
+    written = 0
+    for chunk in decodeFrames(reader, huffman_code, separator, decode_table):
+        writer.write(chunk)
+        written += len(chunk)
+    return written
+
+def encodeFile(input_path, output_path, huffman_code, chunk_size=DEFAULT_CHUNK_SIZE):
+    '''Compress a UTF-8 text file chunk by chunk and report throughput and peak memory.'''
+    def run():
+        with open(input_path, 'r', encoding='utf-8', newline='') as reader, open(output_path, 'wb') as writer:
+            return encodeStream(reader, writer, huffman_code, chunk_size)
+
+    _, duration, _, peak = measure(run, memory=True)
+    return getStreamStats(os.path.getsize(input_path), os.path.getsize(output_path), duration, peak)
+
+def decodeFile(input_path, output_path, huffman_code, decode_table=None):
+    '''Decompress a file written by encodeFile and report throughput and peak memory.'''
+    def run():
+        with open(input_path, 'rb') as reader, open(output_path, 'w', encoding='utf-8', newline='') as writer:
+            return decodeStream(reader, writer, huffman_code, decode_table=decode_table)
+
+    _, duration, _, peak = measure(run, memory=True)
+    return getStreamStats(os.path.getsize(input_path), os.path.getsize(output_path), duration, peak)
+
+def getStreamStats(input_size, output_size, duration, peak):
+    '''Collect the sizes, timing and memory of a streaming run.'''
+    return {
+        'input_size': input_size,
+        'output_size': output_size,
+        'duration': duration,
+        'throughput': getThroughput(input_size, duration),
+        'peak_memory': peak,
+    }
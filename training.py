@@ -1,24 +1,34 @@
-import io
-import numpy as np
-import tensorflow as tf
-import tensorflow_datasets as tfds
-from huffmancoding import huffmanCoding
-import base64
-from PIL import Image
+'''This module trains the Huffman models and loads them for the codecs.
+
+TensorFlow Datasets, NumPy, PIL and the image codec are imported inside the functions that need
+them, so loading a model for compression does not pull in the machine learning stack.'''
+import os
 import random
-def getTextTrainingData(numberOfReviews=1000):
+from huffmancoding import huffmanCoding, canonicalHuffmanCodingFromFrequency, buildCanonicalCode, getLimitedCodeLengths, getLengthLimitCost, getFrequency, getByteFrequency, mergeFrequencies, byteHuffmanCodingFromFrequency, writeByteModelToFile, writeFrequencyToFile, readFrequencyFromFile, writeCanonicalModelToFile
+from wordcoding import getWordFrequency, DEFAULT_MAX_WORDS
+from modelcache import getModel, MODEL_BYTES, MODEL_LEGACY
+
+MODEL_DIRECTORY = './data'
+TEXT_MODEL_FILE = os.path.join(MODEL_DIRECTORY, 'huffman_code_text.bin')
+IMAGE_MODEL_FILE = os.path.join(MODEL_DIRECTORY, 'huffman_code_image.bin')
+BYTE_MODEL_FILE = os.path.join(MODEL_DIRECTORY, 'huffman_code_bytes.bin')
+WORD_MODEL_FILE = os.path.join(MODEL_DIRECTORY, 'huffman_code_words.bin')
+# Symbol counts behind the text model, kept so the model can be updated incrementally
+TEXT_FREQUENCY_FILE = os.path.join(MODEL_DIRECTORY, 'huffman_frequency_text.json')
+# Text "char: code" models written before the canonical binary format
+LEGACY_TEXT_MODEL_FILE = os.path.join(MODEL_DIRECTORY, 'huffman_code_text.data')
+LEGACY_IMAGE_MODEL_FILE = os.path.join(MODEL_DIRECTORY, 'huffman_code_image.data')
 
+def getTextTrainingData(numberOfReviews=1000):
+    import tensorflow_datasets as tfds
     ds,info = tfds.load('imdb_reviews', split='train', as_supervised=True, with_info=True)
-    text = ''
     data = ds.take(numberOfReviews)
     validationData = [text.numpy().decode("utf-8") for text, label in data]
-
-    for review in ds.take(numberOfReviews):
-        text += review[0].numpy().decode('utf-8')
-    return text+" ", validationData
+    return ''.join(validationData)+" ", validationData
 
 
 def getRandomImageGeneratorTrainingData():
+    import numpy as np
     images = []
     for i in range(1000):
         # Generate a random width and height between 16 and 64
@@ -32,7 +42,7 @@ def getRandomImageGeneratorTrainingData():
         stringList = convertToString(image.flatten())
         size = image.size
 
-        images.append((stringList, size))
+        images.append((stringList, size, image.shape))
 
     data =[]
     for image in images:
@@ -43,6 +53,7 @@ def getRandomImageGeneratorTrainingData():
 
 def getImageTrainingData():
     '''Get image training data from tensorflow cifar10 dataset. Combine all images into a single string.'''
+    import tensorflow_datasets as tfds
     ds,_ = tfds.load('cifar10', split='train', as_supervised=True, with_info=True)
     images = []
 
@@ -68,6 +79,8 @@ def convertToString(arrayData):
 
 def convertToImage(stringData):
     '''Convert string of comma delimited integer values into an integer array, then reshape to (32,32,3).'''
+    import numpy as np
+    from PIL import Image
     data = stringData.split(',')
     data = [int(i) for i in data]
     #convert the list of integers to numpy array
@@ -100,37 +113,101 @@ def convertToVector(stringData):
     result = list(map(int, stringData.split(',')))
     return result
 
-def trainHuffmanCodeText():
-    '''Train the Huffman code on text data and save it to a file.'''
-    training_text, _ = getTextTrainingData()
-    huffman_code_text = huffmanCoding(training_text)
-    with open('./data/huffman_code_text.data', 'w',encoding="utf-8") as file:
-        for char, code in huffman_code_text.items():
-            file.write(f"{char}: {code}\n")
+def trainHuffmanCodeText(update=False):
+    '''Train the Huffman code on text data and save it to a file. With update, add to the counts of the saved model.'''
+    _, reviews = getTextTrainingData()
+    frequency = getTextFrequency(reviews)
+    if update and os.path.exists(TEXT_FREQUENCY_FILE):
+        frequency = mergeFrequencies(readFrequencyFromFile(TEXT_FREQUENCY_FILE), frequency)
+    saveHuffmanCodeText(frequency)
+
+def updateHuffmanCodeText(texts):
+    '''Update the saved text model with the counts of new texts instead of retraining from scratch.'''
+    frequency = getTextFrequency(texts)
+    if os.path.exists(TEXT_FREQUENCY_FILE):
+        frequency = mergeFrequencies(readFrequencyFromFile(TEXT_FREQUENCY_FILE), frequency)
+    saveHuffmanCodeText(frequency)
+
+def getTextFrequency(texts):
+    '''Count the characters of every text separately and merge the counts.'''
+    # A space is always part of the model, as in the original concatenated training text
+    return mergeFrequencies({' ': 1}, *(getFrequency(text) for text in texts))
+
+def saveHuffmanCodeText(frequency):
+    '''Save the text model and the counts it was built from.'''
+    huffman_code_text = canonicalHuffmanCodingFromFrequency(frequency)
+    os.makedirs(MODEL_DIRECTORY, exist_ok=True)
+    writeFrequencyToFile(frequency, TEXT_FREQUENCY_FILE)
+    writeCanonicalModelToFile(huffman_code_text, TEXT_MODEL_FILE)
+
+def trainHuffmanCodeBytes():
+    '''Train the byte-level Huffman code on the UTF-8 bytes of the text data and save it to a file.'''
+    _, reviews = getTextTrainingData()
+    frequency = mergeFrequencies(*(getByteFrequency(review.encode('utf-8')) for review in reviews))
+    byte_code = byteHuffmanCodingFromFrequency(frequency)
+    os.makedirs(MODEL_DIRECTORY, exist_ok=True)
+    writeByteModelToFile(byte_code, BYTE_MODEL_FILE)
+
+def getHuffmanCodeByteModel():
+    '''Get the 256-entry byte-level Huffman code table, loaded once and cached.'''
+    return getModel(BYTE_MODEL_FILE, MODEL_BYTES)
+
+def trainHuffmanCodeWords(max_words=DEFAULT_MAX_WORDS):
+    '''Train the word-level Huffman code on the text data and save it to a file.'''
+    _, reviews = getTextTrainingData()
+    huffman_code_words = canonicalHuffmanCodingFromFrequency(getWordFrequency(reviews, max_words))
+    os.makedirs(MODEL_DIRECTORY, exist_ok=True)
+    writeCanonicalModelToFile(huffman_code_words, WORD_MODEL_FILE)
+
+def getHuffmanCodeWordModel():
+    '''Get the word-level Huffman code for text data, loaded once and cached.'''
+    return getModel(WORD_MODEL_FILE)
 
 def getHuffmanCodeTextModel():
-    '''Get the Huffman code for text data.'''
-    huffman_code = {}
-    with open('./data/huffman_code_text.data', 'r', encoding="utf-8") as file:
-        for line in file:
-            char, code = line.strip().split(': ')
-            huffman_code[char] = code
-    return huffman_code
-def trainHuffmanCodeImage():
-    '''Train the Huffman code on image data and save it to a file.'''
-    training_image, _ = getRandomImageGeneratorTrainingData()
-    flattenData = []
-    for image in training_image:
-        print("Training image size: ", len(image))
-        pixel = convertToPixel(image)
-        flattenData.extend(pixel)
-        
-        break
-    
-    huffman_code_image = huffmanCoding(flattenData)
-    with open('./data/huffman_code_image.data', 'w') as file:
-        for char, code in huffman_code_image.items():
-            file.write(f"{char}: {code}\n")
+    '''Get the Huffman code for text data, loaded once and cached.'''
+    if not os.path.exists(TEXT_MODEL_FILE) and os.path.exists(LEGACY_TEXT_MODEL_FILE):
+        return getModel(LEGACY_TEXT_MODEL_FILE, MODEL_LEGACY)
+    return getModel(TEXT_MODEL_FILE)
+def getImageTrainingImages(count=1000):
+    '''Get count CIFAR-10 training images as (32, 32, 3) uint8 arrays.'''
+    import tensorflow_datasets as tfds
+    ds = tfds.load('cifar10', split='train', as_supervised=True)
+    return [image.numpy() for image, _ in ds.take(count)]
+
+def trainHuffmanCodeImage(max_symbols=None, image_filter='none', max_length=None, images=None):
+    '''Train the Huffman code on image data and save it to a file.
+
+    The model is trained on the CIFAR-10 images unless a list of images is given. Every training
+    image is passed through image_filter and counted, the vocabulary is capped to the max_symbols
+    most frequent pixels (imagecoding.DEFAULT_MAX_PIXEL_SYMBOLS by default) and an escape symbol
+    covers the rest, so any image can be encoded with the model. max_length limits the code length to
+    bound decode tables; the vocabulary is then capped to (1 << max_length) - 1 pixels so the
+    pixels and the escape symbol fit in codes of that length.'''
+    from imagecoding import getPixelFrequency, capPixelVocabulary, applyFilter, DEFAULT_MAX_PIXEL_SYMBOLS
+    if max_symbols is None:
+        max_symbols = DEFAULT_MAX_PIXEL_SYMBOLS
+    if max_length is not None:
+        max_symbols = min(max_symbols, (1 << max_length) - 1)
+    if images is None:
+        images = getImageTrainingImages()
+    frequency = mergeFrequencies(*(getPixelFrequency(applyFilter(image, image_filter)) for image in images))
+    print("Training pixels: ", sum(frequency.values()), " unique: ", len(frequency))
+
+    frequency = capPixelVocabulary(frequency, max_symbols)
+    if max_length is None:
+        huffman_code_image = canonicalHuffmanCodingFromFrequency(frequency)
+    else:
+        code_lengths = getLimitedCodeLengths(frequency, max_length)
+        print("Compression ratio cost of limiting codes to", max_length, "bits: ", getLengthLimitCost(frequency, max_length, code_lengths))
+        huffman_code_image = buildCanonicalCode(code_lengths)
+    os.makedirs(MODEL_DIRECTORY, exist_ok=True)
+    writeCanonicalModelToFile(huffman_code_image, getImageModelFile(image_filter))
+
+def getImageModelFile(image_filter='none'):
+    '''Get the model file of the image model trained with the given prediction filter.'''
+    if image_filter == 'none':
+        return IMAGE_MODEL_FILE
+    return os.path.join(MODEL_DIRECTORY, f'huffman_code_image_{image_filter}.bin')
             
 def trainHuffmanCodeImageHash():
     '''Train the Huffman code on image data and save it to a file.'''
@@ -159,11 +236,8 @@ def trainHuffmanCodeImageHash():
         for code in huffman_code_image_hash:
             file.write(f"{code}\n")
 
-def getHuffmanCodeImageModel():
-    '''Get the Huffman code for image data.'''
-    huffman_code = {}
-    with open('./data/huffman_code_image.data', 'r') as file:
-        for line in file:
-            char, code = line.strip().split(': ')
-            huffman_code[char] = code
-    return huffman_code
\ No newline at end of file
+def getHuffmanCodeImageModel(image_filter='none'):
+    '''Get the Huffman code for image data trained with the given prediction filter, loaded once and cached.'''
+    if image_filter == 'none' and not os.path.exists(IMAGE_MODEL_FILE) and os.path.exists(LEGACY_IMAGE_MODEL_FILE):
+        return getModel(LEGACY_IMAGE_MODEL_FILE, MODEL_LEGACY)
+    return getModel(getImageModelFile(image_filter))
@@ -1,35 +1,50 @@
 import unittest
-from huffmancoding import huffmanCoding, encode, decode, getFrequency
-from training import getTextTrainingData, convertToPixel, restorePixelToList, getRandomImageGeneratorTrainingData
-from metrics import getCompressionRatio, measureTime, measureSpace
+from huffmancoding import huffmanCoding, encode, decode, getFrequency, encodeToBytes, decodeFromBytes, packBits, unpackBits, buildDecodeTable, getCachedDecodeTable, decodeSymbols, canonicalHuffmanCoding, getCodeLengths, buildCanonicalCode, serializeCodeLengths, deserializeCodeLengths, getByteFrequency, mergeFrequencies, huffmanCodingFromFrequency, canonicalHuffmanCodingFromFrequency, writeCanonicalModelToFile, writeByteModelToFile, getHuffmanCodeLengths, getLimitedCodeLengths, getEncodedBitLength, getLengthLimitCost, byteHuffmanCoding, encodeBytes, decodeBytes, serializeByteCodeLengths, deserializeByteCodeLengths
+from training import getTextTrainingData, convertToPixel, restorePixelToList, getRandomImageGeneratorTrainingData, trainHuffmanCodeImage, getImageModelFile
 import os
+import io
+import json
+import contextlib
+import subprocess
+import sys
+import tempfile
+from unittest import mock
+from streaming import encodeChunks, encodeStream, decodeStream, encodeFile, decodeFile
+from parallel import compressBlocks, decompressBlocks, decompressBlockAt, readBlockIndex, initWorker, encodeBlock, decodeBlock, decodeByteBlock
+from adaptivecoding import encodeAdaptive, decodeAdaptive
+from wordcoding import tokenizeText, getWordFrequency, wordHuffmanCoding, encodeWords, decodeWords
+from container import compressBytes, decompressBytes, compressImage, decompressImage, compressFile, decompressFile, readContainer, MODEL_ID
+from benchmark import compareReports, summarize, getSyntheticImages
+from program import main as runProgram
+from modelcache import loadModel, getModel, getDecodeTable, getImageTables, setMaxModels, clearModelCache, getModelCacheInfo, MODEL_BYTES, DEFAULT_MAX_MODELS
+import asyncio
+from service import CompressionService, openConnection, sendRequest, packFrame, readFrame, runLoad, OP_COMPRESS, OP_DECOMPRESS, STATUS_OK
+from metrics import Timer, measure, Stage, enableStages, resetStages, getStageReport
+from imagecoding import buildImageCodeTables, encodeImage, decodeImage, decodeKeys, decodeKeysScalar, IMAGE_HEADER, getPixelFrequency, capPixelVocabulary, ESCAPE_PIXEL, applyFilter, invertFilter, IMAGE_FILTERS
+import numpy as np
 
 
 class TestHuffmanCoding(unittest.TestCase):
 
-    def setUp(self):
-        # This method will be run before each test
+    @classmethod
+    def setUpClass(cls):
+        # Load the datasets once for the whole class. Timing lives in benchmark.py.
         trainingText, validationText = getTextTrainingData()
-        self.training_text = trainingText
-        self.validation_text = validationText
-
-        print("Training text size: ", len(self.training_text))
-        self.huffman_code_text = huffmanCoding(self.training_text)
+        cls.training_text = trainingText
+        cls.validation_text = validationText
+        cls.huffman_code_text = huffmanCoding(cls.training_text)
+        cls.decode_table_text = buildDecodeTable(cls.huffman_code_text)
 
-        self.training_image, self.validation_image = getRandomImageGeneratorTrainingData()
+        cls.training_image, cls.validation_image = getRandomImageGeneratorTrainingData()
 
         flattenData = []
-        for image in self.training_image:
+        for image in cls.training_image:
             pixel = convertToPixel(image)
             flattenData.extend(pixel)
 
-        #self.training_image = flattenData
-        self.flattenData = flattenData
-        print("Training image size: ", len(self.training_image))
-        self.huffman_code_image = huffmanCoding(flattenData)
-  
-        #write header to file
-        self.writeHeader()
+        cls.flattenData = flattenData
+        cls.huffman_code_image = huffmanCoding(flattenData)
+        cls.decode_table_image = buildDecodeTable(cls.huffman_code_image)
 
     def convertCorpusToWordList(self, corpus):
         '''Convert a corpus of text to a list of words.'''
@@ -43,111 +58,744 @@ class TestHuffmanCoding(unittest.TestCase):
                 result.append(' ')
 
         return result
-    
-    def test_huffman_code_image(self):
-        '''Test various size number of unique pixel in the image to build out the huffmancode tree, then measure the time and space complexity of building out the huffman code tree.'''
-        frequency = getFrequency(self.flattenData)
-        for i in range(1, len(frequency), 10000):
-            # Get i items from the frequency dictionary
-            subset_frequency = dict(list(frequency.items())[:i])
-            #print("Subset frequency: ", subset_frequency)
-            input_size = len(subset_frequency)
-            # Build Huffman code for the subset
-            huffman_code_subset = huffmanCoding(subset_frequency)
-            # Measure time and space complexity of encoding and decoding the image
-            tree, duration = measureTime(huffmanCoding, subset_frequency)
-            _, current, peak = measureSpace(huffmanCoding, subset_frequency)
-            
-            # Log results
-            self.writeLog("test_huffman_code_tree_images", input_size, len(tree), duration, current, peak)
-
-    def test_huffman_code_text(self):
-        '''Test various size number of unique characters in the text to build out the huffmancode tree, then measure the time and space complexity of building out the huffman code tree.'''
-        frequency = getFrequency(self.training_text)
-
-        for i in range(10, len(frequency), 10):
-            # Get i items from the frequency dictionary
-            subset_frequency = dict(list(frequency.items())[:i])
-
-            input_size = len(subset_frequency)
-
-            # Measure time and space complexity of encoding and decoding the text
-            tree, duration = measureTime(huffmanCoding, subset_frequency)
-            _, current, peak = measureSpace(huffmanCoding, subset_frequency)
-            
-            # Log results
-            self.writeLog("test_huffman_code_tree", input_size, len(tree), duration, current, peak)
-
 
     def test_text_compression(self):
 
         for test_text in self.validation_text:
-            # Measure input size
-            input_size = len(test_text)*8 # Convert bytes to bits
-
-            word_list = test_text
-            encoded_text = encode(word_list, self.huffman_code_text)
-            encoded_text, duration = measureTime(encode, word_list, self.huffman_code_text)
-            _, current, peak = measureSpace(encode, word_list, self.huffman_code_text)
-            # Measure output size
-            output_size = len(encoded_text)
-            
+            encoded_text = encode(test_text, self.huffman_code_text)
+            self.assertLess(len(encoded_text), len(test_text)*8)
+
             # Decode the compressed text
-            decoded_text = decode(encoded_text, self.huffman_code_text)
+            decoded_text = decode(encoded_text, self.huffman_code_text, decode_table=self.decode_table_text)
 
             # Check if the decoded text matches the original text
             self.assertEqual(test_text, decoded_text)
 
-            self.writeLog("test_text_compression",input_size, output_size, duration, current, peak) 
-           
-
-    def test_image_compression(self): 
+    def test_image_compression(self):
 
         for test_image in self.training_image:
-            # Measure input size
-            input_size = len(test_image)*8 # Convert bytes to bits
-
             test_data = convertToPixel(test_image)
+            encoded_image = encode(test_data, self.huffman_code_image)
 
-            encoded_image, duration = measureTime(encode, test_data, self.huffman_code_image)
-            # Measure output size
-            output_size = len(encoded_image)
-            _, current, peak = measureSpace(encode, test_data,  self.huffman_code_image)
             # Decode the compressed image
-            decoded_image = decode(encoded_image,  self.huffman_code_image,' ')
+            decoded_image = decode(encoded_image,  self.huffman_code_image,' ', self.decode_table_image)
             #expend it back to list of integers
             decoded_image_restored = restorePixelToList(decoded_image)
 
             self.assertEqual(test_image, decoded_image_restored)
-          
-            #self.printOutput("test_image_compression", input_size, output_size, duration, current, peak, test_image, encoded_image, decoded_image_restored)
-            self.writeLog("test_image_compression",input_size, output_size, duration, current, peak)
-
-
-
-
-    def writeHeader(self):
-        if not os.path.exists('results.csv'):
-            # Create the file and write the header
-            with open('results.csv', 'w') as result_file:
-                result_file.write("Test Name,Input Size,Output Size,Compression Ratio,Time Taken,Current Memory,Peak Memory\n")
-       
-    def writeLog(self,test_name, input_size, output_size, duration, current, peak):
-        with open('results.csv', 'a') as result_file:
-            result_file.write(f"{test_name},{input_size},{output_size},{getCompressionRatio(input_size, output_size):2f},{duration},{current},{peak}\n")
-    
-    def printOutput(self, test_name, input_size, output_size, duration, current, peak, test_text, encoded_text, decoded_text):
-        print(f"Test Name: {test_name}")
-        print(f"Current memory usage: {current} bytes")
-        print(f"Peak memory usage: {peak} bytes")
-        print(f"Time taken: {duration} seconds")
-        print(f"Input size: {input_size} bits")
-        print(f"Output size: {output_size} bits")
-        print(f"Compression ratio: {getCompressionRatio(input_size, output_size):.2f}")
-        print(f"Original text: {test_text[:10]}...")
-        print(f"Encoded text: {encoded_text[:10]}...")
-        print(f"Decoded text: {decoded_text[:10]}...")
 
+    def test_image_compression_numpy(self):
+        image_tables = buildImageCodeTables(self.huffman_code_image)
+        for test_image in self.training_image:
+            image = np.array(test_image).astype(np.uint8).reshape(1, -1, 3)
+            encoded_image = encodeImage(image, self.huffman_code_image, image_tables)
+            decoded_image = decodeImage(encoded_image, self.huffman_code_image, image_tables)
+            np.testing.assert_array_equal(image, decoded_image)
+
+
+class TestFrequency(unittest.TestCase):
+
+    def test_frequency_counts(self):
+        self.assertEqual(getFrequency("abracadabra"), {'a': 5, 'b': 2, 'r': 2, 'c': 1, 'd': 1})
+        self.assertEqual(getFrequency({'x': 10, 'y': 3}), {'x': 1, 'y': 1})
+
+    def test_byte_and_pixel_frequency(self):
+        self.assertEqual(getByteFrequency("h\u00e9h".encode('utf-8')), {0x68: 2, 0xc3: 1, 0xa9: 1})
+        image = np.array([[[1, 2, 3], [1, 2, 3], [4, 5, 6]]], dtype=np.uint8)
+        self.assertEqual(getPixelFrequency(image), {"1-2-3": 2, "4-5-6": 1})
+
+    def test_merged_shards_match_whole_text(self):
+        shards = ["first shard ", "second shard ", "third"]
+        merged = mergeFrequencies(*(getFrequency(shard) for shard in shards))
+        self.assertEqual(merged, getFrequency(''.join(shards)))
+        self.assertEqual(huffmanCodingFromFrequency(merged), huffmanCoding(''.join(shards)))
+
+
+class TestTreeConstruction(unittest.TestCase):
+
+    def test_known_code_lengths(self):
+        frequency = {'a': 45, 'b': 13, 'c': 12, 'd': 16, 'e': 9, 'f': 5}
+        self.assertEqual(getHuffmanCodeLengths(frequency), {'a': 1, 'b': 3, 'c': 3, 'd': 3, 'e': 4, 'f': 4})
+        self.assertEqual(getHuffmanCodeLengths({'only': 3}), {'only': 1})
+
+    def test_deterministic_ties(self):
+        frequency = {str(i): 1 for i in range(100)}
+        self.assertEqual(huffmanCodingFromFrequency(frequency), huffmanCodingFromFrequency(dict(frequency)))
+        lengths = getHuffmanCodeLengths(frequency)
+        self.assertEqual(sum(2 ** -length for length in lengths.values()), 1)
+
+
+class TestLengthLimitedCodes(unittest.TestCase):
+
+    def setUp(self):
+        # Fibonacci weights give the deepest possible Huffman tree
+        weights = [1, 1]
+        while len(weights) < 30:
+            weights.append(weights[-1] + weights[-2])
+        self.frequency = {f"s{i}": weight for i, weight in enumerate(weights)}
+
+    def test_lengths_are_capped(self):
+        self.assertEqual(max(getHuffmanCodeLengths(self.frequency).values()), 29)
+        lengths = getLimitedCodeLengths(self.frequency, 8)
+        self.assertEqual(max(lengths.values()), 8)
+        self.assertEqual(sum(2 ** -length for length in lengths.values()), 1)
+        huffman_code = canonicalHuffmanCodingFromFrequency(self.frequency, 8)
+        text = list(self.frequency)
+        self.assertEqual(decodeSymbols(encode(text, huffman_code), huffman_code), text)
+
+    def test_cost_is_reported_as_ratio(self):
+        self.assertEqual(getLengthLimitCost(self.frequency, 29), 1)
+        self.assertGreater(getLengthLimitCost(self.frequency, 8), 1)
+        self.assertEqual(getLengthLimitCost(self.frequency, 8, getLimitedCodeLengths(self.frequency, 8)), getLengthLimitCost(self.frequency, 8))
+        self.assertLess(getEncodedBitLength(self.frequency, getLimitedCodeLengths(self.frequency, 8)),
+                        getEncodedBitLength(self.frequency, getLimitedCodeLengths(self.frequency, 5)))
+
+    def test_too_short_limit(self):
+        with self.assertRaises(ValueError):
+            getLimitedCodeLengths(self.frequency, 4)
+
+
+class TestPackedBits(unittest.TestCase):
+
+    def test_pack_unpack_bits(self):
+        for bits in ['', '1', '0110', '10110011', '101100111']:
+            packed = packBits(bits)
+            self.assertEqual(len(packed), (len(bits) + 7) // 8)
+            self.assertEqual(unpackBits(packed, len(bits)), bits)
+
+    def test_packed_round_trip(self):
+        text = "the quick brown fox jumps over the lazy dog"
+        huffman_code = huffmanCoding(text)
+        packed = encodeToBytes(text, huffman_code)
+        self.assertLess(len(packed), len(text))
+        self.assertEqual(decodeFromBytes(packed, huffman_code), text)
+
+    def test_truncated_packed_data(self):
+        huffman_code = huffmanCoding("abcabc")
+        packed = encodeToBytes("abcabc", huffman_code)
+        with self.assertRaises(ValueError):
+            decodeFromBytes(packed[:-1], huffman_code)
+
+    def test_decode_table_matches_bitwise_decoding(self):
+        # Skewed weights give codes longer than one byte
+        text = ''.join(chr(ord('a') + i) * (2 ** i) for i in range(16))
+        huffman_code = huffmanCoding(text)
+        self.assertGreater(max(len(code) for code in huffman_code.values()), 8)
+        decode_table = buildDecodeTable(huffman_code)
+        encoded_text = encode(text, huffman_code)
+        self.assertEqual(decode(encoded_text, huffman_code, decode_table=decode_table), text)
+        # Reusing the table and dropping an incomplete trailing code
+        self.assertEqual(decode(encoded_text[:-1], huffman_code, decode_table=decode_table), text[:-1])
+        self.assertEqual(decode(encode(["p", "a"], huffman_code), huffman_code, ' '), "p a")
+
+    def test_default_decode_reuses_cached_table(self):
+        text = "she sells sea shells by the sea shore"
+        huffman_code = huffmanCoding(text)
+        packed = encodeToBytes(text, huffman_code)
+        self.assertEqual(decodeFromBytes(packed, huffman_code), text)
+        decode_table = getCachedDecodeTable(huffman_code)
+        self.assertIs(getCachedDecodeTable(dict(huffman_code)), decode_table)
+        self.assertEqual(decode(encode(text, huffman_code), huffman_code), text)
+        # Joined-text entries are kept per separator next to the symbol rows
+        self.assertEqual(decodeFromBytes(packed, huffman_code, '-'), '-'.join(text))
+        self.assertEqual(set(decode_table['text']), {'', '-'})
+
+
+class TestByteCoding(unittest.TestCase):
+
+    def setUp(self):
+        self.byte_code = byteHuffmanCoding("plain ascii training text".encode('utf-8'))
+
+    def test_every_byte_has_a_code(self):
+        self.assertEqual(len(self.byte_code), 256)
+        self.assertTrue(all(self.byte_code))
+
+    def test_unseen_characters_round_trip(self):
+        data = "caf\u00e9 \u2603 \U0001f600 \x00 text".encode('utf-8')
+        self.assertEqual(decodeBytes(encodeBytes(data, self.byte_code), self.byte_code), data)
+
+    def test_byte_model_round_trip(self):
+        data = serializeByteCodeLengths(self.byte_code)
+        self.assertEqual(len(data), 256)
+        self.assertEqual(deserializeByteCodeLengths(data), self.byte_code)
+
+
+class TestAdaptiveCoding(unittest.TestCase):
+
+    def test_round_trip_without_model(self):
+        for data in [b'', b'x', bytes(range(256)) * 4, "adaptive caf\u00e9 ".encode('utf-8') * 500]:
+            self.assertEqual(decodeAdaptive(encodeAdaptive(data, block_size=1000)), data)
+
+    def test_adapts_to_drifting_data(self):
+        data = b'ab' * 5000 + b'xyz' * 5000
+        encoded = encodeAdaptive(data, block_size=1024, count_limit=4096)
+        self.assertLess(len(encoded), len(data) // 3)
+        self.assertEqual(decodeAdaptive(encoded), data)
+
+    def test_truncated_stream(self):
+        encoded = encodeAdaptive(b'some adaptive data' * 50)
+        with self.assertRaises(ValueError):
+            decodeAdaptive(encoded[:-5])
+
+
+class TestWordCoding(unittest.TestCase):
+
+    def setUp(self):
+        self.corpus = "This movie was great. This movie was not great, it was long.\n" * 50
+        self.word_code = wordHuffmanCoding(self.corpus, max_words=5)
+
+    def test_tokens_concatenate_to_text(self):
+        self.assertEqual(tokenizeText("Great movie!  10/10"), ["Great", " ", "movie", "!  ", "10", "/", "10"])
+        self.assertEqual(''.join(tokenizeText(self.corpus)), self.corpus)
+
+    def test_vocabulary_is_capped_with_character_fallback(self):
+        frequency = getWordFrequency([self.corpus], max_words=5)
+        self.assertEqual(len([token for token in frequency if len(token) > 1]), 5)
+        self.assertTrue(set(self.corpus) <= set(frequency))
+
+    def test_round_trip_with_unknown_words(self):
+        text = "This long movie was a great, great win.\n"
+        self.assertEqual(decodeWords(encodeWords(text, self.word_code), self.word_code), text)
+        with self.assertRaises(KeyError):
+            encodeWords("unknown character: \u2603", self.word_code)
+
+    def test_better_ratio_than_characters(self):
+        character_code = huffmanCoding(self.corpus)
+        self.assertLess(len(encodeWords(self.corpus, wordHuffmanCoding(self.corpus))), len(encodeToBytes(self.corpus, character_code)))
+
+
+class TestCanonicalModel(unittest.TestCase):
+
+    def test_canonical_code_keeps_lengths(self):
+        text = "abracadabra: a newline\nand colons: : :"
+        huffman_code = huffmanCoding(text)
+        canonical_code = canonicalHuffmanCoding(text)
+        self.assertEqual(getCodeLengths(canonical_code), getCodeLengths(huffman_code))
+        self.assertEqual(decode(encode(text, canonical_code), canonical_code), text)
+
+    def test_serialized_model_round_trip(self):
+        text = "abracadabra: a newline\nand colons: : : \u00e9\u4e2d"
+        code_lengths = getCodeLengths(canonicalHuffmanCoding(text))
+        data = serializeCodeLengths(code_lengths)
+        self.assertEqual(deserializeCodeLengths(data), code_lengths)
+        self.assertEqual(buildCanonicalCode(deserializeCodeLengths(data)), canonicalHuffmanCoding(text))
+
+    def test_invalid_model_data(self):
+        with self.assertRaises(ValueError):
+            deserializeCodeLengths(b'NOPE\x01\x00')
+
+    def test_truncated_model_data(self):
+        data = serializeCodeLengths(getCodeLengths(canonicalHuffmanCoding("the rain in spain stays mainly in the plain")))
+        for cut in range(1, len(data)):
+            with self.assertRaises(ValueError):
+                deserializeCodeLengths(data[:-cut])
+        with self.assertRaises(ValueError):
+            deserializeCodeLengths(data + b'h')
+
+
+class TestModelCache(unittest.TestCase):
+
+    def setUp(self):
+        clearModelCache()
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+        self.addCleanup(clearModelCache)
+        self.addCleanup(setMaxModels, DEFAULT_MAX_MODELS)
+
+    def writeModel(self, name, text):
+        path = os.path.join(self.directory.name, name)
+        writeCanonicalModelToFile(canonicalHuffmanCoding(text), path)
+        return path
+
+    def test_model_is_loaded_once(self):
+        path = self.writeModel('text.bin', "abracadabra")
+        entry = loadModel(path)
+        self.assertIs(loadModel(path), entry)
+        self.assertEqual(entry['code'], canonicalHuffmanCoding("abracadabra"))
+        info = getModelCacheInfo()
+        self.assertEqual((info['hits'], info['misses']), (1, 1))
+
+    def test_decode_table_is_built_on_request_and_shared(self):
+        path = self.writeModel('lazy.bin', "mississippi river")
+        code = getModel(path)
+        self.assertNotIn('decode_table', loadModel(path))
+        decode_table = getDecodeTable(path)
+        self.assertTrue(decode_table['filled'])
+        self.assertTrue(all(None not in row for row in decode_table['rows']))
+        self.assertIs(getCachedDecodeTable(code), decode_table)
+        self.assertEqual(decode(encode("mississippi", code), code), "mississippi")
+
+    def test_byte_model_and_changed_file(self):
+        path = os.path.join(self.directory.name, 'bytes.bin')
+        writeByteModelToFile(byteHuffmanCoding(b"aaaab"), path)
+        self.assertEqual(getModel(path, MODEL_BYTES), byteHuffmanCoding(b"aaaab"))
+        writeByteModelToFile(byteHuffmanCoding(b"bbbbbbbba"), path)
+        os.utime(path, ns=(0, 0))
+        self.assertEqual(getModel(path, MODEL_BYTES), byteHuffmanCoding(b"bbbbbbbba"))
+
+    def test_least_recently_used_model_is_evicted(self):
+        setMaxModels(2)
+        first, second, third = (self.writeModel(f'{name}.bin', name * 3 + "xy") for name in "abc")
+        loadModel(first)
+        loadModel(second)
+        loadModel(first)
+        loadModel(third)
+        info = getModelCacheInfo()
+        self.assertEqual(info['evictions'], 1)
+        self.assertEqual(info['models'], [os.path.abspath(first), os.path.abspath(third)])
+
+    def test_image_tables_are_cached(self):
+        path = os.path.join(self.directory.name, 'pixels.bin')
+        writeCanonicalModelToFile(canonicalHuffmanCodingFromFrequency({'0-0-0': 5, '255-255-255': 3, ESCAPE_PIXEL: 1}), path)
+        tables = getImageTables(path)
+        self.assertIs(getImageTables(path), tables)
+        image = np.zeros((2, 3, 3), dtype=np.uint8)
+        self.assertTrue(np.array_equal(decodeImage(encodeImage(image, getModel(path), tables), getModel(path), tables), image))
+
+
+class TestStreaming(unittest.TestCase):
+
+    def setUp(self):
+        self.text = "streams of text,\nline after line\r\n" * 200
+        self.huffman_code = huffmanCoding(self.text)
+
+    def test_stream_round_trip(self):
+        compressed = io.BytesIO()
+        encodeStream(io.StringIO(self.text), compressed, self.huffman_code, chunk_size=100)
+        compressed.seek(0)
+        decompressed = io.StringIO()
+        decodeStream(compressed, decompressed, self.huffman_code)
+        self.assertEqual(decompressed.getvalue(), self.text)
+
+    def test_file_round_trip(self):
+        with tempfile.TemporaryDirectory() as directory:
+            source = os.path.join(directory, 'source.txt')
+            compressed = os.path.join(directory, 'source.huf')
+            restored = os.path.join(directory, 'restored.txt')
+            with open(source, 'w', encoding='utf-8', newline='') as file:
+                file.write(self.text)
+            stats = encodeFile(source, compressed, self.huffman_code, chunk_size=256)
+            self.assertLess(stats['output_size'], stats['input_size'])
+            self.assertGreater(stats['peak_memory'], 0)
+            decodeFile(compressed, restored, self.huffman_code)
+            with open(restored, 'r', encoding='utf-8', newline='') as file:
+                self.assertEqual(file.read(), self.text)
+
+    def test_separator_between_frames(self):
+        pixels = ["1-2-3", "4-5-6", "7-8-9"] * 5
+        huffman_code = huffmanCoding(pixels)
+        frames = b''.join(encodeChunks([pixels[:2], pixels[2:7], pixels[7:]], huffman_code))
+        decompressed = io.StringIO()
+        decodeStream(io.BytesIO(frames), decompressed, huffman_code, ' ')
+        self.assertEqual(decompressed.getvalue(), ' '.join(pixels))
+
+    def test_truncated_stream(self):
+        compressed = io.BytesIO()
+        encodeStream(io.StringIO(self.text), compressed, self.huffman_code)
+        with self.assertRaises(ValueError):
+            decodeStream(io.BytesIO(compressed.getvalue()[:-3]), io.StringIO(), self.huffman_code)
+
+
+class TestParallelBlocks(unittest.TestCase):
+
+    def setUp(self):
+        self.text = "independent blocks decode in parallel. " * 500
+        self.huffman_code = huffmanCoding(self.text)
+
+    def test_parallel_round_trip(self):
+        data = compressBlocks(self.text, self.huffman_code, block_size=4096, max_workers=2)
+        self.assertEqual(len(readBlockIndex(data)), 5)
+        self.assertEqual(decompressBlocks(data, self.huffman_code, max_workers=2), self.text)
+
+    def test_random_access(self):
+        data = compressBlocks(self.text, self.huffman_code, block_size=4096, max_workers=1)
+        self.assertEqual(decompressBlockAt(data, self.huffman_code, 2), self.text[8192:12288])
+
+    def test_corrupt_index_and_blocks_are_detected(self):
+        data = compressBlocks(self.text, self.huffman_code, block_size=4096, max_workers=1)
+        start, _, _, _, _ = readBlockIndex(data)[2]
+        corrupt_block = data[:start] + bytes([data[start] ^ 1]) + data[start + 1:]
+        self.assertEqual(decompressBlockAt(corrupt_block, self.huffman_code, 1), self.text[4096:8192])
+        with self.assertRaises(ValueError):
+            decompressBlockAt(corrupt_block, self.huffman_code, 2)
+        corrupt_index = data[:12] + bytes([data[12] ^ 1]) + data[13:]
+        with self.assertRaises(ValueError):
+            decompressBlocks(corrupt_index, self.huffman_code, max_workers=1)
+
+    def test_symbol_list_blocks(self):
+        pixels = ["1-2-3", "4-5-6", "1-2-3", "7-8-9"] * 10
+        huffman_code = huffmanCoding(pixels)
+        data = compressBlocks(pixels, huffman_code, block_size=7, max_workers=1)
+        self.assertEqual(decompressBlocks(data, huffman_code, ' ', max_workers=1), ' '.join(pixels))
+
+    def test_workers_return_joined_blocks(self):
+        data = compressBlocks(self.text, self.huffman_code, block_size=4096, max_workers=1)
+        start, end, bit_length, _, _ = readBlockIndex(data)[1]
+        initWorker(self.huffman_code)
+        self.assertEqual(decodeBlock((data[start:end], bit_length, '')), self.text[4096:8192])
+        byte_code = byteHuffmanCoding(b"worker bytes")
+        initWorker(byte_code)
+        bit_length, packed = encodeBlock(b"worker bytes")
+        self.assertEqual(decodeByteBlock((packed, bit_length)), b"worker bytes")
+
+
+class TestImageCoding(unittest.TestCase):
+
+    def setUp(self):
+        rng = np.random.default_rng(7)
+        palette = rng.integers(0, 256, (50, 3), dtype=np.uint8)
+        self.image = palette[rng.zipf(1.6, (24, 40)) % 50]
+        pixels = [f"{r}-{g}-{b}" for r, g, b in self.image.reshape(-1, 3)]
+        self.pixels = pixels
+        self.huffman_code = canonicalHuffmanCoding(pixels)
+
+    def test_image_round_trip(self):
+        encoded_image = encodeImage(self.image, self.huffman_code)
+        self.assertLess(len(encoded_image), self.image.nbytes)
+        np.testing.assert_array_equal(decodeImage(encoded_image, self.huffman_code), self.image)
+
+    def test_matches_string_encoder(self):
+        encoded_image = encodeImage(self.image, self.huffman_code)
+        self.assertEqual(encoded_image[IMAGE_HEADER.size:], packBits(encode(self.pixels, self.huffman_code)))
+
+    def test_small_groups_and_segments(self):
+        tables = buildImageCodeTables(self.huffman_code)
+        encoded_image = encodeImage(self.image, self.huffman_code, tables)
+        bit_length = IMAGE_HEADER.unpack_from(encoded_image)[-1]
+        packed = np.frombuffer(encoded_image, dtype=np.uint8, offset=IMAGE_HEADER.size)
+        expected = decodeKeysScalar(packed, bit_length, self.image.shape[0] * self.image.shape[1], tables)
+        np.testing.assert_array_equal(decodeKeys(packed, bit_length, self.image.shape[0] * self.image.shape[1], tables, scalar_symbols=0), expected)
+        for group_bits, segment_bits in ((64, 16), (61, 7), (1000, 1000)):
+            keys = decodeKeys(packed, bit_length, self.image.shape[0] * self.image.shape[1], tables, group_bits, segment_bits, scalar_symbols=0)
+            np.testing.assert_array_equal(keys, expected)
+
+    def test_oversized_header_is_rejected(self):
+        encoded_image = encodeImage(self.image, self.huffman_code)
+        magic, version, filter_id, height, width, bit_length = IMAGE_HEADER.unpack_from(encoded_image)
+        header = IMAGE_HEADER.pack(magic, version, filter_id, 60000, 60000, bit_length)
+        with self.assertRaises(ValueError):
+            decodeImage(header + encoded_image[IMAGE_HEADER.size:], self.huffman_code)
+        header = IMAGE_HEADER.pack(magic, version, filter_id, height, width - 1, bit_length)
+        with self.assertRaises(ValueError):
+            decodeImage(header + encoded_image[IMAGE_HEADER.size:], self.huffman_code)
+
+    def test_unknown_pixel(self):
+        image = self.image.copy()
+        image[0, 0] = [1, 2, 3] if "1-2-3" not in self.huffman_code else [3, 2, 1]
+        with self.assertRaises(KeyError):
+            encodeImage(image, self.huffman_code)
+
+    def test_escape_unknown_pixels(self):
+        frequency = capPixelVocabulary(getPixelFrequency(self.image), max_symbols=10)
+        self.assertEqual(len(frequency), 11)
+        self.assertIn(ESCAPE_PIXEL, frequency)
+        huffman_code = canonicalHuffmanCodingFromFrequency(frequency)
+        image = self.image.copy()
+        image[0, :3] = [[1, 2, 3], [255, 255, 255], [0, 0, 0]]
+        np.testing.assert_array_equal(decodeImage(encodeImage(image, huffman_code), huffman_code), image)
+
+    def test_prediction_filters(self):
+        rows, columns = np.mgrid[0:20, 0:30]
+        smooth = np.stack([rows * 5 + columns, columns * 7, rows * 3 + columns * 2], axis=-1).astype(np.uint8)
+        unfiltered_symbols = len(getPixelFrequency(smooth))
+        for image_filter in IMAGE_FILTERS:
+            residual = applyFilter(smooth, image_filter)
+            np.testing.assert_array_equal(invertFilter(residual, image_filter), smooth)
+            huffman_code = canonicalHuffmanCodingFromFrequency(capPixelVocabulary(getPixelFrequency(residual)))
+            encoded_image = encodeImage(smooth, huffman_code, image_filter=image_filter)
+            np.testing.assert_array_equal(decodeImage(encoded_image, huffman_code), smooth)
+            if image_filter != 'none':
+                self.assertLess(len(huffman_code), unfiltered_symbols)
+
+
+    def test_train_filter_model_on_smooth_images(self):
+        images = getSyntheticImages(20)
+        with tempfile.TemporaryDirectory() as directory, mock.patch('training.MODEL_DIRECTORY', directory), contextlib.redirect_stdout(io.StringIO()):
+            trainHuffmanCodeImage(image_filter='paeth', images=images)
+            model_file = getImageModelFile('paeth')
+            self.assertTrue(model_file.startswith(directory))
+            huffman_code = getModel(model_file)
+        image = getSyntheticImages(1, seed=1)[0]
+        encoded_image = encodeImage(image, huffman_code, image_filter='paeth')
+        self.assertLess(len(encoded_image), image.nbytes / 2)
+        np.testing.assert_array_equal(decodeImage(encoded_image, huffman_code), image)
+
+    def test_train_with_max_length_caps_vocabulary(self):
+        rng = np.random.default_rng(3)
+        images = [rng.integers(0, 256, (160, 160, 3), dtype=np.uint8) for _ in range(4)]
+        with tempfile.TemporaryDirectory() as directory, mock.patch('training.MODEL_DIRECTORY', directory), contextlib.redirect_stdout(io.StringIO()):
+            for max_length in (15, 16):
+                trainHuffmanCodeImage(image_filter='delta', max_length=max_length, images=images)
+                huffman_code = getModel(getImageModelFile('delta'))
+                self.assertEqual(len(huffman_code), 1 << max_length)
+                self.assertLessEqual(max(map(len, huffman_code.values())), max_length)
+
+class TestContainer(unittest.TestCase):
+
+    def setUp(self):
+        self.data = "a self-describing container \u2603\n".encode('utf-8') * 300
+
+    def test_embedded_model_round_trip(self):
+        payload = compressBytes(self.data, block_size=1000, max_workers=1)
+        container = readContainer(payload)
+        self.assertEqual(container['original_length'], len(self.data))
+        self.assertEqual(len(container['blocks']), 10)
+        self.assertEqual(decompressBytes(payload, max_workers=1), self.data)
+
+    def test_model_id_requires_matching_model(self):
+        byte_code = byteHuffmanCoding(self.data)
+        payload = compressBytes(self.data, byte_code, embed_model=False, max_workers=1)
+        self.assertEqual(decompressBytes(payload, byte_code, max_workers=1), self.data)
+        with self.assertRaises(ValueError):
+            decompressBytes(payload, max_workers=1)
+        with self.assertRaises(ValueError):
+            decompressBytes(payload, byteHuffmanCoding(b'other data'), max_workers=1)
+
+    def test_corrupt_block_is_detected(self):
+        payload = bytearray(compressBytes(self.data, max_workers=1))
+        payload[-10] ^= 0xFF
+        with self.assertRaises(ValueError):
+            decompressBytes(bytes(payload), max_workers=1)
+
+    def test_swapped_model_bytes_are_detected(self):
+        payload = bytearray(compressBytes(self.data, max_workers=1))
+        model = readContainer(bytes(payload))['model']
+        start = bytes(payload).index(model)
+        first = start + next(i for i in range(len(model) - 1) if model[i] != model[i + 1])
+        payload[first], payload[first + 1] = payload[first + 1], payload[first]
+        with self.assertRaises(ValueError):
+            decompressBytes(bytes(payload), max_workers=1)
+
+    def test_image_container(self):
+        image = np.stack(np.mgrid[0:12, 0:20], axis=-1).sum(axis=-1, keepdims=True).repeat(3, axis=-1).astype(np.uint8)
+        huffman_code = canonicalHuffmanCodingFromFrequency(capPixelVocabulary(getPixelFrequency(image)))
+        payload = compressImage(image, huffman_code)
+        self.assertEqual(readContainer(payload)['shape'], (12, 20, 3))
+        np.testing.assert_array_equal(decompressImage(payload), image)
+
+    def test_file_round_trip(self):
+        with tempfile.TemporaryDirectory() as directory:
+            source = os.path.join(directory, 'source.bin')
+            compressed = os.path.join(directory, 'source.hufz')
+            restored = os.path.join(directory, 'restored.bin')
+            with open(source, 'wb') as file:
+                file.write(self.data)
+            compressFile(source, compressed, max_workers=1)
+            decompressFile(compressed, restored, max_workers=1)
+            with open(restored, 'rb') as file:
+                self.assertEqual(file.read(), self.data)
+
+
+class TestService(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+        self.addCleanup(clearModelCache)
+        self.model_path = os.path.join(self.directory.name, 'bytes.bin')
+        writeByteModelToFile(byteHuffmanCoding(b"the quick brown fox jumps over the lazy dog " * 20), self.model_path)
+        self.samples = [f"request {i}: the lazy dog sleeps".encode('utf-8') * (i + 1) for i in range(20)]
+
+    async def pipelineRequests(self, service, operation, payloads):
+        reader, writer = await openConnection(*service.getAddress())
+        for request_id, payload in enumerate(payloads):
+            writer.write(packFrame(operation, request_id, payload))
+        await writer.drain()
+        responses = {}
+        for _ in payloads:
+            status, request_id, payload = await readFrame(reader)
+            self.assertEqual(status, STATUS_OK)
+            responses[request_id] = payload
+        writer.close()
+        await writer.wait_closed()
+        return [responses[request_id] for request_id in range(len(payloads))]
+
+    def test_pipelined_requests_are_batched(self):
+        async def run():
+            # A single pending slot exercises backpressure: requests are read one at a time.
+            for max_pending in (256, 1):
+                service = CompressionService(self.model_path, max_workers=0, max_pending=max_pending, batch_delay=0.01)
+                await service.start(port=0)
+                try:
+                    compressed = await self.pipelineRequests(service, OP_COMPRESS, self.samples)
+                    self.assertEqual(await self.pipelineRequests(service, OP_DECOMPRESS, compressed), self.samples)
+                finally:
+                    await service.close()
+                self.assertEqual(service.statistics['requests'], 2 * len(self.samples))
+                if max_pending > 1:
+                    self.assertLess(service.statistics['batches'], service.statistics['requests'])
+        asyncio.run(run())
+
+    def test_errors_keep_the_connection_open(self):
+        async def run():
+            service = CompressionService(self.model_path, max_workers=0)
+            await service.start(port=0)
+            try:
+                reader, writer = await openConnection(*service.getAddress())
+                with self.assertRaises(ValueError):
+                    await sendRequest(reader, writer, OP_DECOMPRESS, b'\x00')
+                self.assertTrue(await sendRequest(reader, writer, OP_COMPRESS, b'still here'))
+                writer.close()
+                await writer.wait_closed()
+            finally:
+                await service.close()
+        asyncio.run(run())
+
+    def test_idle_connections_hold_no_slot(self):
+        async def run():
+            service = CompressionService(self.model_path, max_workers=0, max_pending=2)
+            await service.start(port=0)
+            try:
+                idle = [await openConnection(*service.getAddress()) for _ in range(4)]
+                reader, writer = await openConnection(*service.getAddress())
+                compressed = await asyncio.wait_for(sendRequest(reader, writer, OP_COMPRESS, self.samples[0]), 5)
+                self.assertEqual(await sendRequest(reader, writer, OP_DECOMPRESS, compressed), self.samples[0])
+                for _, idle_writer in idle + [(reader, writer)]:
+                    idle_writer.close()
+                    await idle_writer.wait_closed()
+            finally:
+                await service.close()
+        asyncio.run(run())
+
+    def test_load_generator_without_requests(self):
+        async def run():
+            service = CompressionService(self.model_path, max_workers=0)
+            await service.start(port=0)
+            try:
+                return await runLoad(*service.getAddress(), connections=1, requests=0)
+            finally:
+                await service.close()
+        result = asyncio.run(run())
+        self.assertEqual((result['requests'], result['mean'], result['p99']), (0, 0.0, 0.0))
+
+    def test_load_generator_with_process_pool(self):
+        async def run():
+            path = os.path.join(self.directory.name, 'service.sock')
+            service = CompressionService(self.model_path, max_workers=2)
+            await service.start(path=path)
+            try:
+                return await runLoad(path=path, connections=4, requests=40, size=512, operation=OP_DECOMPRESS)
+            finally:
+                await service.close()
+        result = asyncio.run(run())
+        self.assertEqual(result['requests'], 40)
+        self.assertLessEqual(result['p50'], result['p99'])
+        self.assertGreater(result['requests_per_second'], 0)
+
+
+class TestBenchmark(unittest.TestCase):
+
+    def writeReport(self, directory, name, medians):
+        path = os.path.join(directory, name)
+        with open(path, 'w', encoding='utf-8') as file:
+            json.dump({'metadata': {}, 'results': {key: summarize([median], 1e6) for key, median in medians.items()}}, file)
+        return path
+
+    def test_summary_statistics(self):
+        summary = summarize([0.3, 0.1, 0.2], 2e6)
+        self.assertEqual(summary['median'], 0.2)
+        self.assertEqual(summary['min'], 0.1)
+        self.assertAlmostEqual(summary['throughput_mb_s'], 10)
+
+    def test_compare_flags_regressions(self):
+        with tempfile.TemporaryDirectory() as directory, contextlib.redirect_stdout(io.StringIO()):
+            baseline = self.writeReport(directory, 'baseline.json', {'encode': 1.0, 'decode': 1.0})
+            candidate = self.writeReport(directory, 'candidate.json', {'encode': 1.05, 'decode': 1.5})
+            self.assertEqual(compareReports(baseline, candidate, threshold=0.1), ['decode'])
+
+
+class TestMetrics(unittest.TestCase):
+
+    def tearDown(self):
+        enableStages(False)
+        resetStages()
+
+    def test_timer_and_combined_measure(self):
+        with Timer() as timer:
+            sum(range(1000))
+        self.assertGreater(timer.duration_ns, 0)
+        result, duration, _, peak = measure(lambda: [0] * 100000, memory=True)
+        self.assertEqual(len(result), 100000)
+        self.assertGreater(duration, 0)
+        self.assertGreaterEqual(peak, 800000)
+
+    def test_stages_are_recorded_only_when_enabled(self):
+        resetStages()
+        encodeToBytes("abracadabra", huffmanCoding("abracadabra"))
+        self.assertEqual(getStageReport(), {})
+        enableStages()
+        text = "abracadabra" * 10
+        code = huffmanCoding(text)
+        decodeFromBytes(encodeToBytes(text, code), code)
+        report = getStageReport()
+        for name in ('frequency', 'tree_build', 'encode', 'pack', 'decode'):
+            self.assertEqual(report[name]['count'], 1)
+        self.assertEqual(sum(report['encode']['histogram'].values()), 1)
+
+    def test_stage_decorator_and_context_manager(self):
+        enableStages()
+        timed = Stage('custom')(lambda value: value * 2)
+        self.assertEqual(timed(21), 42)
+        with Stage('custom'):
+            pass
+        summary = getStageReport()['custom']
+        self.assertEqual(summary['count'], 2)
+        self.assertLessEqual(summary['min'], summary['p50'])
+        self.assertLessEqual(summary['p99'], summary['max'])
+
+
+class TestProgram(unittest.TestCase):
+
+    def test_cli_round_trip(self):
+        data = "The quick brown fox jumps over the lazy dog. ".encode('utf-8') * 200
+        with tempfile.TemporaryDirectory() as directory, contextlib.redirect_stderr(io.StringIO()):
+            original = os.path.join(directory, 'input.txt')
+            compressed = os.path.join(directory, 'input.huf')
+            restored = os.path.join(directory, 'restored.txt')
+            with open(original, 'wb') as file:
+                file.write(data)
+            runProgram(['compress', original, '-o', compressed])
+            runProgram(['decompress', compressed, '-o', restored])
+            with open(restored, 'rb') as file:
+                self.assertEqual(file.read(), data)
+            self.assertLess(os.path.getsize(compressed), len(data))
+
+    def test_image_containers_store_the_model_id_by_default(self):
+        from PIL import Image
+        image = getSyntheticImages(1, seed=2)[0]
+        with tempfile.TemporaryDirectory() as directory, mock.patch('training.MODEL_DIRECTORY', directory), \
+                contextlib.redirect_stdout(io.StringIO()), contextlib.redirect_stderr(io.StringIO()):
+            trainHuffmanCodeImage(image_filter='paeth', images=getSyntheticImages(20))
+            original = os.path.join(directory, 'image.png')
+            compressed = os.path.join(directory, 'image.huf')
+            embedded = os.path.join(directory, 'embedded.huf')
+            restored = os.path.join(directory, 'restored.png')
+            Image.fromarray(image).save(original)
+            runProgram(['compress', original, '--image', '-o', compressed])
+            runProgram(['compress', original, '--image', '--embed', '-o', embedded])
+            runProgram(['decompress', compressed, '-o', restored])
+            with open(compressed, 'rb') as file:
+                payload = file.read()
+            self.assertEqual(readContainer(payload)['model_type'], MODEL_ID)
+            self.assertLess(len(payload), image.nbytes)
+            self.assertGreater(os.path.getsize(embedded), len(payload))
+            np.testing.assert_array_equal(np.asarray(Image.open(restored)), image)
+
+    def test_unreadable_image_is_reported(self):
+        with tempfile.TemporaryDirectory() as directory:
+            original = os.path.join(directory, 'notes.txt')
+            with open(original, 'wb') as file:
+                file.write(b"not an image")
+            with self.assertRaises(SystemExit) as context:
+                runProgram(['compress', original, '--image', '-o', os.path.join(directory, 'notes.huf')])
+            self.assertIn("Error", str(context.exception.code))
+
+    def test_codec_imports_without_ml_stack(self):
+        modules = ('tensorflow', 'tensorflow_datasets', 'PIL', 'numpy')
+        script = f"import sys, program; print([m for m in {modules!r} if m in sys.modules])"
+        result = subprocess.run([sys.executable, '-c', script], capture_output=True, text=True, check=True,
+                                cwd=os.path.dirname(os.path.abspath(__file__)))
+        self.assertEqual(result.stdout.strip(), '[]')
 
 
 if __name__ == '__main__':
@@ -0,0 +1,62 @@
+'''This module implements word-level Huffman coding for text.
+
+Text is split into word tokens and runs of non-word characters. The model holds the most
+frequent tokens plus every character seen in training, so a token outside the model is
+encoded character by character. Decoding is a plain concatenation of the decoded symbols.'''
+import re
+from collections import Counter
+from huffmancoding import canonicalHuffmanCodingFromFrequency, encodeToBytes, decodeFromBytes
+
+# Words and runs of anything else, e.g. "Great movie!" -> "Great", " ", "movie", "!"
+TOKEN_PATTERN = re.compile(r'\w+|\W+')
+# Number of multi-character tokens kept in a word model.
+DEFAULT_MAX_WORDS = 4096
+
+
+def tokenizeText(text):
+    '''Split text into word and non-word tokens that concatenate back to the text.'''
+    return TOKEN_PATTERN.findall(text)
+
+def getWordFrequency(texts, max_words=DEFAULT_MAX_WORDS):
+    '''Count the tokens of the texts, keeping the max_words most frequent multi-character tokens.
+
+    The characters of dropped tokens are counted instead, and every character seen gets a
+    count of at least 1 so any token made of known characters can be encoded.'''
+    token_counts = Counter()
+    for text in texts:
+        token_counts.update(tokenizeText(text))
+
+    words = [(token, count) for token, count in token_counts.most_common() if len(token) > 1]
+    frequency = Counter(dict(words[:max_words]))
+    for token, count in words[max_words:]:
+        for char in token:
+            frequency[char] += count
+    for token, count in token_counts.items():
+        if len(token) == 1:
+            frequency[token] += count
+    for char in set(''.join(token_counts)):
+        if not frequency[char]:
+            frequency[char] = 1
+    return dict(frequency)
+
+def wordHuffmanCoding(text, max_words=DEFAULT_MAX_WORDS):
+    '''Perform word-level Huffman coding on the given text.'''
+    return canonicalHuffmanCodingFromFrequency(getWordFrequency([text], max_words))
+
+def tokenizeForModel(text, word_code):
+    '''Split text into symbols of the word model, falling back to characters for unknown tokens.'''
+    symbols = []
+    for token in tokenizeText(text):
+        if token in word_code:
+            symbols.append(token)
+        else:
+            symbols.extend(token)
+    return symbols
+
+def encodeWords(text, word_code):
+    '''Encode text with a word model into a packed bitstream prefixed with its bit length.'''
+    return encodeToBytes(tokenizeForModel(text, word_code), word_code)
+
+def decodeWords(data, word_code, decode_table=None):
+    '''Decode a packed bitstream produced by encodeWords.'''
+    return decodeFromBytes(data, word_code, '', decode_table)